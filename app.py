@@ -1,7 +1,12 @@
+import atexit
 import os
+import queue
 import shutil
 import sqlite3
 import socket
+import sys
+import threading
+import time
 from flask import Flask, render_template, request, redirect, url_for, send_file, flash, Response, session, jsonify
 
 # ---------------------------------------------------------------------------
@@ -12,11 +17,12 @@ from flask import Flask, render_template, request, redirect, url_for, send_file,
 # zipfile: utilizzato per creare archivi ZIP sia per l'export CSV che per il pacchetto completo.
 import json
 import io
+import operator
 import zipfile
 import qrcode
 from io import BytesIO
 from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
+from functools import lru_cache, wraps
 import csv
 from datetime import datetime, timedelta
 from urllib.parse import quote
@@ -208,6 +214,62 @@ def _parse_location_string(loc: str):
         return None, None
     return m.group(1), int(m.group(2))
 
+# Possibili ubicazioni (lettera A-Z, numero 1-99) per i menu a tendina e i filtri.
+UBICAZIONE_LETTERE = tuple(chr(l) for l in range(ord('A'), ord('Z') + 1))
+UBICAZIONE_NUMERI = tuple(range(1, 100))
+
+# Colonne che identificano una combinazione completa di anagrafica articolo.
+COMBO_COLUMNS = ('materiale', 'tipo', 'spessore', 'dimensione_x', 'dimensione_y', 'produttore')
+
+def _combo_key(row) -> tuple[str, str, str, str, str, str]:
+    """Costruisce la chiave di combinazione a 6 elementi per una riga.
+
+    I valori ``None`` vengono normalizzati a stringa vuota e ogni
+    elemento viene internato con ``sys.intern``: le chiavi generate per
+    i documenti e per i bancali condividono così le stesse stringhe e i
+    confronti nei dizionari avvengono per identità.
+    """
+    return tuple(sys.intern(str(row[col] or '')) for col in COMBO_COLUMNS)
+
+def _s(value) -> str:
+    """Restituisce ``value`` senza spazi iniziali/finali, o stringa vuota se assente.
+
+    Equivale a ``(value or '').strip()`` ma evita la stringa temporanea
+    quando il valore è ``None`` o vuoto.
+    """
+    return value.strip() if value else ''
+
+# Separatore (ASCII Unit Separator) usato per le chiavi composite in forma di stringa.
+COMBO_KEY_SEP = '\x1f'
+
+def _ckey(*parts: str) -> str:
+    """Unisce le parti di una combinazione in un'unica chiave stringa.
+
+    A differenza delle tuple, il cui hash viene ricalcolato ad ogni
+    ricerca, una stringa memorizza il proprio hash: le mappe di soglie,
+    giacenze e combinazioni attive consultate più volte per riga
+    risultano così più economiche.
+    """
+    return COMBO_KEY_SEP.join(parts)
+
+# Elenco esplicito delle colonne di ``materiali`` lette dalla dashboard.
+# L'ordine è fisso (a differenza di ``SELECT *``, che dipende dalle
+# migrazioni applicate) e permette ai cicli più frequenti di accedere alle
+# righe ``sqlite3.Row`` per indice intero tramite le costanti ``COL_*``,
+# evitando la ricerca del nome di colonna ad ogni accesso.
+MATERIALI_DASHBOARD_COLUMNS = (
+    'id', 'materiale', 'dimensioni', 'spessore', 'quantita',
+    'ubicazione_lettera', 'ubicazione_numero', 'fornitore', 'note',
+    'dimensione_x', 'dimensione_y', 'parent_id', 'is_sfrido', 'is_pallet',
+    'tipo', 'produttore',
+)
+(
+    COL_ID, COL_MATERIALE, COL_DIMENSIONI, COL_SPESSORE, COL_QUANTITA,
+    COL_UBIC_LETTERA, COL_UBIC_NUMERO, COL_FORNITORE, COL_NOTE,
+    COL_DIM_X, COL_DIM_Y, COL_PARENT_ID, COL_IS_SFRIDO, COL_IS_PALLET,
+    COL_TIPO, COL_PRODUTTORE,
+) = range(len(MATERIALI_DASHBOARD_COLUMNS))
+
 # The ``MATERIALI`` constant remains for backwards compatibility but is no
 # longer used directly in the application.  The list of available
 # materials is now stored in a dedicated SQLite table (see
@@ -290,9 +352,9 @@ def init_id_db() -> None:
 def record_used_ids(ids: list[int]) -> None:
     """Registra una o più ID di lastre nel database nascosto.
 
-    Accetta un elenco di interi e, per ciascuno, esegue un
-    ``INSERT OR IGNORE`` nella tabella ``slab_ids`` del database
-    nascosto.  In questo modo gli ID vengono memorizzati una sola
+    Accetta un elenco di interi e li inserisce con un unico
+    ``executemany`` di ``INSERT OR IGNORE`` nella tabella ``slab_ids``
+    del database nascosto.  In questo modo gli ID vengono memorizzati una sola
     volta e non sono mai rimossi.  La funzione gestisce
     silenziosamente eventuali errori di inserimento e assicura il
     commit al termine.
@@ -305,12 +367,14 @@ def record_used_ids(ids: list[int]) -> None:
         with get_id_db_connection() as conn:
             # Assicura che la tabella esista prima dell'inserimento
             conn.execute('CREATE TABLE IF NOT EXISTS slab_ids (id INTEGER PRIMARY KEY)')
+            params: list[tuple[int]] = []
             for rid in ids:
                 try:
-                    conn.execute('INSERT OR IGNORE INTO slab_ids (id) VALUES (?)', (int(rid),))
+                    params.append((int(rid),))
                 except Exception:
-                    # Se l'inserimento fallisce (ad esempio se rid non è convertibile) ignora
+                    # Se rid non è convertibile in intero lo ignoriamo
                     pass
+            conn.executemany('INSERT OR IGNORE INTO slab_ids (id) VALUES (?)', params)
             try:
                 conn.commit()
             except Exception:
@@ -320,6 +384,71 @@ def record_used_ids(ids: list[int]) -> None:
         # l'inserimento del materiale nel DB principale.
         pass
 
+# Coda delle ID da registrare nel database nascosto.  La registrazione è
+# "best effort" (gli errori vengono già ignorati), quindi può avvenire
+# dopo la risposta HTTP: un unico thread daemon svuota la coda e
+# raggruppa in un solo ``record_used_ids`` tutte le richieste accumulate.
+_used_ids_queue: queue.Queue = queue.Queue()
+_used_ids_worker_lock = threading.Lock()
+_used_ids_worker: threading.Thread | None = None
+
+def _drain_used_ids_queue(block: bool = True) -> None:
+    """Registra in blocco tutte le ID presenti nella coda.
+
+    Attende (se ``block``) il primo lotto e poi raccoglie senza attendere
+    quelli già accodati, in modo da eseguire un solo inserimento.
+    """
+    try:
+        ids = list(_used_ids_queue.get(block=block))
+    except queue.Empty:
+        return
+    batches = 1
+    while True:
+        try:
+            ids.extend(_used_ids_queue.get_nowait())
+            batches += 1
+        except queue.Empty:
+            break
+    try:
+        record_used_ids(ids)
+    finally:
+        for _ in range(batches):
+            _used_ids_queue.task_done()
+
+def _used_ids_worker_loop() -> None:
+    while True:
+        try:
+            _drain_used_ids_queue()
+        except Exception:
+            pass
+
+def queue_used_ids(ids: list[int]) -> None:
+    """Accoda le ID appena create per la registrazione in background.
+
+    Il thread di scrittura viene avviato alla prima chiamata.  Alla
+    chiusura del processo le ID ancora in coda vengono registrate in modo
+    sincrono (vedi ``_flush_used_ids_queue``).
+    """
+    global _used_ids_worker
+    if not ids:
+        return
+    _used_ids_queue.put(list(ids))
+    if _used_ids_worker is None or not _used_ids_worker.is_alive():
+        with _used_ids_worker_lock:
+            if _used_ids_worker is None or not _used_ids_worker.is_alive():
+                _used_ids_worker = threading.Thread(
+                    target=_used_ids_worker_loop, name='slab-ids-writer', daemon=True
+                )
+                _used_ids_worker.start()
+
+@atexit.register
+def _flush_used_ids_queue() -> None:
+    while not _used_ids_queue.empty():
+        try:
+            _drain_used_ids_queue(block=False)
+        except Exception:
+            break
+
 # ----------------------------------------------------------------------
 # Configurazione stampante Zebra
 #
@@ -827,16 +956,78 @@ if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
+# Numero massimo di connessioni inattive conservate per il riuso.
+DB_POOL_SIZE = 8
+_db_pool: queue.LifoQueue = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connessione SQLite che alla chiusura torna nel pool invece di chiudersi.
+
+    ``close()`` annulla l'eventuale transazione rimasta aperta e rimette la
+    connessione in ``_db_pool``; solo se il pool è pieno (o la connessione
+    non è più utilizzabile) viene chiusa davvero.  Anche l'uscita da un
+    blocco ``with`` restituisce la connessione dopo il commit/rollback
+    automatico di sqlite3.
+    """
+
+    _released = False
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            if self.in_transaction:
+                self.rollback()
+            _db_pool.put_nowait(self)
+        except Exception:
+            super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        result = super().__exit__(exc_type, exc_value, traceback)
+        self.close()
+        return result
+
+
 def get_db_connection():
     """Restituisce una connessione al database SQLite con factory su Row e applica PRAGMA per performance.
 
     Questa funzione configura la connessione con modalità WAL, sincronizzazione NORMAL,
-    memorizzazione temporanea in memoria e abilita le chiavi esterne.  Queste impostazioni
+    memorizzazione temporanea in memoria, memory-mapping e cache di pagine più ampia e
+    abilita le chiavi esterne.  Queste impostazioni
     migliorano le prestazioni complessive dell'applicazione riducendo il tempo di scrittura
-    e garantendo al contempo l'integrità dei dati.
+    e garantendo al contempo l'integrità dei dati.  Le connessioni chiuse
+    tornano in un piccolo pool (vedi ``PooledConnection``) e vengono
+    riutilizzate dalle richieste successive senza riaprire il file.
     """
-    conn = sqlite3.connect(DATABASE)
+    # Riusa una connessione inattiva del pool: ha già i PRAGMA applicati e
+    # la cache degli statement compilati.
+    try:
+        conn = _db_pool.get_nowait()
+    except queue.Empty:
+        conn = None
+    if conn is not None:
+        conn._released = False
+        return conn
+    # Cache degli statement compilati più ampia del default (128): le route
+    # principali eseguono molte query diverse sulla stessa connessione.
+    # check_same_thread=False perché una connessione del pool può essere
+    # riutilizzata da un thread diverso da quello che l'ha aperta (mai da
+    # due thread contemporaneamente).
+    conn = sqlite3.connect(
+        DATABASE,
+        cached_statements=256,
+        check_same_thread=False,
+        factory=PooledConnection,
+    )
     conn.row_factory = sqlite3.Row
+    # LOWER() di SQLite converte solo i caratteri ASCII: ``py_lower`` usa
+    # str.lower() di Python per i confronti case-insensitive su testo accentato
+    # (ad esempio "Èlite").
+    conn.create_function(
+        'py_lower', 1, lambda s: None if s is None else str(s).lower(), deterministic=True
+    )
     try:
         # Modalità WAL per scritture concorrenti e migliore throughput.
         conn.execute("PRAGMA journal_mode=WAL")
@@ -844,6 +1035,10 @@ def get_db_connection():
         conn.execute("PRAGMA synchronous=NORMAL")
         # Archivia temporanei in memoria per operazioni più veloci.
         conn.execute("PRAGMA temp_store=MEMORY")
+        # Lettura del file tramite memory-mapping (fino a 256 MB) e cache
+        # di pagine da 64 MB per connessione.
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-65536")
         # Abilita le chiavi esterne in SQLite per integrità referenziale.
         conn.execute("PRAGMA foreign_keys=ON")
     except Exception:
@@ -926,7 +1121,7 @@ def log_slab_event(
         # In caso di errore nella registrazione ignoriamo l'eccezione per non interrompere il flusso principale
         pass
 
-def log_slab_events(events: list[dict]) -> None:
+def log_slab_events(events: list[dict], conn: sqlite3.Connection | None = None) -> None:
     """
     Registra più eventi nello storico lastre in un'unica transazione.
 
@@ -939,6 +1134,9 @@ def log_slab_events(events: list[dict]) -> None:
     Se una chiave è assente verrà interpretata come ``None``.  La colonna ``timestamp`` verrà
     valorizzata automaticamente con l'istante corrente per ogni evento.  L'utente viene determinato
     una volta sola per tutti gli eventi.
+
+    Se viene passata una connessione ``conn`` gli eventi vengono inseriti nella
+    transazione già aperta dal chiamante, senza eseguire il commit.
     """
     if not events:
         return
@@ -966,16 +1164,19 @@ def log_slab_events(events: list[dict]) -> None:
             ev.get('note'),
             ev.get('nesting_link'),
         ))
+    sql = (
+        "INSERT INTO slab_history (slab_id, event_type, timestamp, user, "
+        "from_letter, from_number, to_letter, to_number, "
+        "dimensione_x, dimensione_y, spessore, materiale, tipo, fornitore, produttore, note, nesting_link) "
+        "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
+    )
     try:
-        with get_db_connection() as conn:
-            conn.executemany(
-                "INSERT INTO slab_history (slab_id, event_type, timestamp, user, "
-                "from_letter, from_number, to_letter, to_number, "
-                "dimensione_x, dimensione_y, spessore, materiale, tipo, fornitore, produttore, note, nesting_link) "
-                "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
-                rows,
-            )
-            conn.commit()
+        if conn is not None:
+            conn.executemany(sql, rows)
+            return
+        with get_db_connection() as own_conn:
+            own_conn.executemany(sql, rows)
+            own_conn.commit()
     except Exception:
         # Se c'è un errore nella registrazione non interrompiamo il flusso principale
         pass
@@ -1064,6 +1265,75 @@ def get_attachments(material_id: int) -> list[sqlite3.Row]:
         except Exception:
             return []
 
+def get_attachments_bulk(material_ids) -> dict[int, list[sqlite3.Row]]:
+    """Come :func:`get_attachments`, ma per più materiali con un'unica query.
+
+    Restituisce un dizionario ``{material_id: [righe documenti]}`` con una
+    voce (eventualmente vuota) per ciascun ID richiesto.  In caso di
+    problemi di database le liste restano vuote.
+    """
+    ids = list(dict.fromkeys(material_ids))
+    result: dict[int, list[sqlite3.Row]] = {mid: [] for mid in ids}
+    if not ids:
+        return result
+    with get_db_connection() as conn:
+        try:
+            placeholders = ','.join('?' * len(ids))
+            cur = conn.execute(
+                f"SELECT id, filename, original_name, material_id FROM documenti WHERE material_id IN ({placeholders}) ORDER BY id",
+                ids
+            )
+            for row in cur.fetchall():
+                result[row['material_id']].append(row)
+        except Exception:
+            pass
+    return result
+
+# ---------------------------------------------------------------------------
+# Cache dei documenti per la dashboard
+#
+# La dashboard raggruppa ad ogni richiesta tutti i documenti per ID
+# materiale e per combinazione di anagrafica.  Poiché i documenti cambiano
+# raramente, le due mappe vengono conservate a livello di modulo insieme ad
+# un token ``(COUNT(*), MAX(id))`` della tabella ``documenti``: se il token
+# non cambia le mappe vengono riutilizzate.  Le operazioni che modificano i
+# documenti senza variarne numero o ID massimo (es. ricollegamento ad un
+# altro materiale) devono chiamare ``invalidate_attachments_cache``.
+_attachments_cache: dict = {'token': None, 'maps': None}
+
+def invalidate_attachments_cache() -> None:
+    """Forza la ricostruzione delle mappe documenti alla prossima richiesta."""
+    _attachments_cache['token'] = None
+
+def get_attachment_maps(conn: sqlite3.Connection) -> tuple[dict, dict]:
+    """Restituisce le mappe ``(attachments_by_material_id, attachments_by_combo)``.
+
+    Le mappe vengono ricostruite solo se il token della tabella
+    ``documenti`` è cambiato rispetto all'ultima richiesta.  Le liste
+    restituite sono condivise tra le richieste e non devono essere
+    modificate dal chiamante.
+    """
+    token = tuple(conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM documenti").fetchone())
+    maps = _attachments_cache['maps']
+    if maps is not None and _attachments_cache['token'] == token:
+        return maps
+    docs = conn.execute(
+        "SELECT id, material_id, original_name, materiale, tipo, spessore, dimensione_x, dimensione_y, produttore "
+        "FROM documenti"
+    ).fetchall()
+    by_material_id: dict[int | None, list[sqlite3.Row]] = {}
+    # La chiave di by_combo è una tupla a 6 elementi comprendente il produttore
+    by_combo: dict[tuple[str, str, str, str, str, str], list[sqlite3.Row]] = {}
+    for d in docs:
+        # Associa documento a material_id (può essere 0 o NULL per documenti legati solo alla combinazione)
+        by_material_id.setdefault(d['material_id'], []).append(d)
+        # Costruisci chiave di combinazione normalizzando a stringa vuota i valori mancanti
+        by_combo.setdefault(_combo_key(d), []).append(d)
+    maps = (by_material_id, by_combo)
+    _attachments_cache['maps'] = maps
+    _attachments_cache['token'] = token
+    return maps
+
 # ------------------------------------------------------------
 # Helper functions for saving uploaded documents
 
@@ -1133,6 +1403,35 @@ def save_file_to_id(content_bytes: bytes, ext: str, target_id: int, doc_type: st
     :param doc_type: 'pallet' per documenti del bancale, 'materiale' per documenti specifici della lastra
     :return: percorso relativo da registrare nel database
     """
+    relative_path, dest_path = _document_destination(ext, target_id, doc_type)
+    # Scrive il contenuto sul disco
+    with open(dest_path, 'wb') as out_f:
+        out_f.write(content_bytes)
+    return relative_path
+
+
+def link_file_to_id(src_path: str, ext: str, target_id: int, doc_type: str = 'pallet') -> str:
+    """
+    Replica un file già presente su disco nella cartella documenti di un ID.
+
+    La struttura delle cartelle è la stessa di :func:`save_file_to_id`, ma
+    invece di riscrivere il contenuto viene creato un hard link al file
+    sorgente.  Se il link non è possibile (ad esempio file system diversi o
+    non supportati) il file viene copiato con ``shutil.copyfile``.
+
+    :param src_path: percorso assoluto del file da replicare
+    :return: percorso relativo da registrare nel database
+    """
+    relative_path, dest_path = _document_destination(ext, target_id, doc_type)
+    try:
+        os.link(src_path, dest_path)
+    except OSError:
+        shutil.copyfile(src_path, dest_path)
+    return relative_path
+
+
+def _document_destination(ext: str, target_id: int, doc_type: str) -> tuple[str, str]:
+    """Restituisce (percorso relativo, percorso assoluto) per un nuovo documento di ``target_id``."""
     date_str = datetime.now().strftime('%Y%m%d')
     subfolder = 'Documenti_pallet' if doc_type == 'pallet' else 'Documenti_materiale'
     # Directory di destinazione assoluta
@@ -1147,11 +1446,7 @@ def save_file_to_id(content_bytes: bytes, ext: str, target_id: int, doc_type: st
     relative_path = os.path.join(str(target_id), subfolder, date_str, unique_name)
     # Normalizza per sistemi Windows sostituendo backslash con slash
     relative_path = relative_path.replace('\\', '/')
-    dest_path = os.path.join(base_dir, unique_name)
-    # Scrive il contenuto sul disco
-    with open(dest_path, 'wb') as out_f:
-        out_f.write(content_bytes)
-    return relative_path
+    return relative_path, os.path.join(base_dir, unique_name)
 
 
 def init_db():
@@ -1215,6 +1510,17 @@ def init_db():
         # automatically without losing data.
         if 'produttore' not in existing_cols:
             conn.execute("ALTER TABLE materiali ADD COLUMN produttore TEXT")
+        # Normalizza quantità e flag a interi: eventuali valori testuali
+        # (importazioni da versioni precedenti) vengono convertiti e i flag
+        # NULL diventano 0.  In questo modo i cicli della dashboard possono
+        # leggere ``quantita``, ``is_sfrido`` e ``is_pallet`` direttamente,
+        # senza conversioni e senza blocchi try/except per ogni riga.
+        conn.execute(
+            "UPDATE materiali SET quantita = CAST(quantita AS INTEGER) "
+            "WHERE typeof(quantita) != 'integer'"
+        )
+        conn.execute("UPDATE materiali SET is_sfrido = 0 WHERE is_sfrido IS NULL")
+        conn.execute("UPDATE materiali SET is_pallet = 0 WHERE is_pallet IS NULL")
         conn.commit()
 
         # ------------------------------------------------------------------
@@ -1262,6 +1568,12 @@ def init_db():
         conn.execute("CREATE INDEX IF NOT EXISTS idx_materiali_parent ON materiali (parent_id)")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_materiali_is_pallet ON materiali (is_pallet)")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_materiali_location ON materiali (ubicazione_lettera, ubicazione_numero)")
+        # Indice coprente per la ricerca dei bancali presenti in una ubicazione
+        # (inserimento di nuove lastre) e per il controllo "ubicazione già occupata
+        # da un altro materiale".  Il vecchio idx_materiali_pallet_loc ne era un
+        # prefisso ridondante e viene rimosso dai database esistenti.
+        conn.execute("DROP INDEX IF EXISTS idx_materiali_pallet_loc")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_materiali_pallet_at_loc ON materiali (is_pallet, ubicazione_lettera, ubicazione_numero, materiale)")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_materiali_type ON materiali (materiale, tipo, spessore)")
         conn.commit()
 
@@ -1762,6 +2074,14 @@ def init_db():
             for col, typ in required_cols:
                 if col not in existing_cols:
                     conn.execute(f"ALTER TABLE documenti ADD COLUMN {col} {typ}")
+            # Indice sulle stesse espressioni COALESCE usate per cercare i documenti
+            # di una combinazione (material_id=0): la ricerca diventa un'unica
+            # seek sull'indice, e le query per material_id ne sfruttano il prefisso.
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_documenti_combo ON documenti (material_id, "
+                "COALESCE(materiale,''), COALESCE(tipo,''), COALESCE(spessore,''), "
+                "COALESCE(dimensione_x,''), COALESCE(dimensione_y,''), COALESCE(produttore,''))"
+            )
             conn.commit()
         except Exception:
             # In caso di errore nella verifica o alterazione della tabella documenti
@@ -1859,6 +2179,13 @@ def init_db():
                 conn.execute(f"ALTER TABLE {PRENOTAZIONI_TABLE} ADD COLUMN is_generic INTEGER DEFAULT 0")
         except sqlite3.Error:
             pass
+        # Indice per le ricerche delle prenotazioni di una lastra (specifiche o generiche),
+        # eseguite a ogni rimozione e nelle pagine di dettaglio.
+        try:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_prenotazioni_material ON {PRENOTAZIONI_TABLE} (material_id, is_generic)")
+            conn.commit()
+        except sqlite3.Error:
+            pass
 
         # ------------------------------------------------------------------
         # Storico dei riordini effettuati
@@ -1933,7 +2260,40 @@ def init_db():
         except sqlite3.Error:
             pass
 
+# ---------------------------------------------------------------------------
+# Cache dei vocabolari
+#
+# I vocabolari (materiali, fornitori, produttori, tipi) e i valori distinti
+# delle dimensioni vengono letti ad ogni caricamento della dashboard e delle
+# maschere di inserimento, ma cambiano raramente.  Il risultato di ciascuna funzione viene quindi
+# conservato per ``VOCAB_CACHE_TTL`` secondi; la cache viene svuotata da
+# ``clear_vocab_cache`` dopo ogni richiesta che modifica i dati.
+VOCAB_CACHE_TTL = 60  # secondi
+_vocab_cache: dict[str, tuple[float, list]] = {}
+
+def _vocab_cached(func):
+    """Decoratore che memorizza per ``VOCAB_CACHE_TTL`` secondi l'elenco restituito.
+
+    Al chiamante viene sempre restituita una copia della lista, così
+    eventuali modifiche locali non alterano il valore in cache.
+    """
+    @wraps(func)
+    def wrapper() -> list:
+        now = time.monotonic()
+        hit = _vocab_cache.get(func.__name__)
+        if hit is not None and now - hit[0] < VOCAB_CACHE_TTL:
+            return list(hit[1])
+        value = func()
+        _vocab_cache[func.__name__] = (now, value)
+        return list(value)
+    return wrapper
+
+def clear_vocab_cache() -> None:
+    """Invalida tutti i vocabolari memorizzati."""
+    _vocab_cache.clear()
+
 # Helper: retrieve the list of materials from the vocabulary table.
+@_vocab_cached
 def get_materiali_vocabolario() -> list:
     """Restituisce un elenco di materiali disponibili nel vocabolario.
 
@@ -1953,6 +2313,7 @@ def get_materiali_vocabolario() -> list:
             return list(DEFAULT_MATERIALI)
 
 # Helper: retrieve the list of suppliers from the vocabulary table.
+@_vocab_cached
 def get_fornitori_vocabolario() -> list:
     """Restituisce un elenco di fornitori disponibili nel vocabolario.
 
@@ -1968,6 +2329,7 @@ def get_fornitori_vocabolario() -> list:
             return []
 
 # Helper: retrieve the list of producers from the vocabulary table.
+@_vocab_cached
 def get_produttori_vocabolario() -> list:
     """Restituisce un elenco di produttori disponibili nel vocabolario.
 
@@ -1983,6 +2345,7 @@ def get_produttori_vocabolario() -> list:
             return []
 
 # Helper: retrieve the list of types from the vocabulary table.
+@_vocab_cached
 def get_tipi_vocabolario() -> list:
     """Restituisce l'elenco dei tipi di lavorazione/materiali disponibili.
 
@@ -1997,6 +2360,27 @@ def get_tipi_vocabolario() -> list:
         except sqlite3.Error:
             return []
 
+# Helper: distinct dimension/thickness values used by the add form datalists.
+@_vocab_cached
+def get_dim_datalists() -> list:
+    """Restituisce ``[dimensioni_x, dimensioni_y, spessori]`` presenti in magazzino.
+
+    Ciascun elemento è la lista dei valori distinti e non vuoti della
+    rispettiva colonna di ``materiali``, ordinati numericamente.  Viene
+    memorizzata come i vocabolari e invalidata dalle stesse richieste.
+    """
+    result: list[list] = []
+    with get_db_connection() as conn:
+        for col in ('dimensione_x', 'dimensione_y', 'spessore'):
+            try:
+                rows = conn.execute(
+                    f"SELECT DISTINCT {col} FROM materiali WHERE {col} IS NOT NULL AND TRIM({col}) != '' ORDER BY CAST({col} AS INT)"
+                ).fetchall()
+                result.append([row[col] for row in rows if row[col] is not None])
+            except sqlite3.Error:
+                result.append([])
+    return result
+
 # Helper: retrieve the list of machines from the vocabulary table.
 def get_macchine_vocabolario() -> list:
     """Restituisce l'elenco delle macchine disponibili per le prenotazioni.
@@ -2294,6 +2678,32 @@ def require_login():
         return redirect(url_for('login'))
 
 
+# ---------------------------------------------------------------------------
+# Cache della dashboard
+#
+# Il rendering della dashboard (caricamento di tutte le lastre, filtri e
+# template) è l'operazione più costosa dell'applicazione ed è spesso
+# ripetuto con gli stessi parametri (ricarica della pagina, ritorno dal
+# dettaglio).  L'HTML generato viene quindi conservato per pochi secondi
+# per combinazione di filtri e utente.  Ogni richiesta che può modificare
+# i dati (metodo diverso da GET/HEAD) incrementa ``_data_version`` e
+# invalida così tutte le pagine in cache.
+DASHBOARD_CACHE_TTL = 5  # secondi
+DASHBOARD_CACHE_MAX_ENTRIES = 256
+_dashboard_cache: dict[tuple, tuple[int, float, str]] = {}
+_data_version = 0
+
+
+@app.after_request
+def bump_data_version(response):
+    """Invalida la cache della dashboard e dei vocabolari dopo ogni richiesta di modifica."""
+    global _data_version
+    if request.method not in ('GET', 'HEAD'):
+        _data_version += 1
+        clear_vocab_cache()
+    return response
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """Gestisce la pagina di accesso dell'utente.
@@ -2676,6 +3086,142 @@ def delete_user(user_id: int):
     return render_template('confirm_delete_user.html', user={'id': row['id'], 'username': row['username']})
 
 
+# Cache del contatore "Da riordinare" della dashboard.  Il valore dipende
+# da giacenze, anagrafica articoli, soglie, accettazioni e RDO: viene
+# riutilizzato finché ``_data_version`` non cambia (cioè finché nessuna
+# richiesta di modifica è stata servita) e comunque per non più di
+# ``REORDER_COUNT_CACHE_TTL`` secondi.
+REORDER_COUNT_CACHE_TTL = 30  # secondi
+_reorder_count_cache: dict = {'version': None, 'ts': 0.0, 'count': 0}
+
+def count_reorder_combinations(conn: sqlite3.Connection, threshold_map_combo: dict[str, int]) -> int:
+    """Conta le combinazioni dell'anagrafica articoli da riordinare.
+
+    Una combinazione completa (materiale, tipo, spessore, dimensioni,
+    produttore) viene conteggiata se la giacenza totale è minore o uguale
+    alla relativa soglia (estesa o, in mancanza, legacy) e non è già in
+    accettazione o in RDO.  ``threshold_map_combo`` contiene le soglie
+    legacy indicizzate con ``_ckey(materiale, tipo, spessore)``.  Il
+    risultato viene memorizzato in ``_reorder_count_cache``.
+    """
+    version = _data_version
+    cached = _reorder_count_cache
+    if cached['version'] == version and time.monotonic() - cached['ts'] < REORDER_COUNT_CACHE_TTL:
+        return cached['count']
+    count = 0
+    # Recupera tutte le combinazioni distinte dell'anagrafica articoli
+    # includendo produttore.  Dimensioni e produttore vengono ripuliti dagli
+    # spazi già in SQL, così DISTINCT elimina anche i duplicati che
+    # differiscono solo per spazi iniziali/finali.
+    try:
+        catalog_rows = conn.execute(
+            "SELECT DISTINCT materiale, COALESCE(tipo,'') AS tipo, COALESCE(spessore,'') AS spessore, "
+            "TRIM(COALESCE(dimensione_x,'')) AS dx, TRIM(COALESCE(dimensione_y,'')) AS dy, "
+            "TRIM(COALESCE(produttore,'')) AS prod "
+            "FROM articoli_catalogo"
+        ).fetchall()
+    except sqlite3.Error:
+        catalog_rows = []
+    # Senza combinazioni in anagrafica non c'è nulla da conteggiare: evita
+    # le letture di soglie, accettazioni e RDO.
+    if not catalog_rows:
+        return 0
+    # Carica mappe delle soglie estese per combinazione completa
+    threshold_map_ext: dict[str, int] = {}
+    try:
+        ext_rows = conn.execute(
+            "SELECT materiale, COALESCE(tipo,'') AS tipo, COALESCE(spessore,'') AS spessore, "
+            "COALESCE(dimensione_x,'') AS dx, COALESCE(dimensione_y,'') AS dy, COALESCE(produttore,'') AS prod, "
+            "threshold FROM riordino_soglie_ext"
+        ).fetchall()
+        for er in ext_rows:
+            k = _ckey(
+                er['materiale'],
+                er['tipo'] or '',
+                er['spessore'] or '',
+                _s(er['dx']),
+                _s(er['dy']),
+                _s(er['prod']),
+            )
+            try:
+                threshold_map_ext[k] = int(er['threshold'])
+            except (ValueError, TypeError):
+                threshold_map_ext[k] = DEFAULT_REORDER_THRESHOLD
+    except sqlite3.Error:
+        threshold_map_ext = {}
+    # Recupera combinazioni attive (in accettazione e RDO) includendo produttore
+    active_keys_ext: set[str] = set()
+    try:
+        # Un'unica query per accettazioni e RDO.  Per le accettazioni il
+        # produttore (singolo) viene restituito come ``prod_sel``; per le RDO
+        # il campo ``prods`` può contenere una lista separata da virgole.
+        act_rows = conn.execute(
+            "SELECT COALESCE(materiale,'') AS materiale, COALESCE(tipo,'') AS tipo, COALESCE(spessore,'') AS spessore, "
+            "COALESCE(dimensione_x,'') AS dx, COALESCE(dimensione_y,'') AS dy, "
+            "'' AS prods, COALESCE(produttore,'') AS prod_sel "
+            "FROM riordini_accettazione "
+            "UNION ALL "
+            "SELECT COALESCE(materiale,''), COALESCE(tipo,''), COALESCE(spessore,''), "
+            "COALESCE(dimensione_x,''), COALESCE(dimensione_y,''), "
+            "COALESCE(produttori,''), COALESCE(produttore_scelto,'') "
+            "FROM riordini_rdo"
+        ).fetchall()
+        for r in act_rows:
+            mat = (r['materiale'] or '')
+            tpv = (r['tipo'] or '')
+            spv = (r['spessore'] or '')
+            dxv = _s(r['dx'])
+            dyv = _s(r['dy'])
+            prod_sel = _s(r['prod_sel'])
+            # Il produttore scelto prevale; altrimenti si usa l'elenco separato
+            # da virgole (stringa vuota se l'elenco non contiene valori).
+            prod_list = [prod_sel] if prod_sel else (
+                [p for p in map(str.strip, (r['prods'] or '').split(',')) if p] or ['']
+            )
+            for p in prod_list:
+                active_keys_ext.add(_ckey(mat, tpv, spv, dxv, dyv, p))
+    except sqlite3.Error:
+        active_keys_ext = set()
+    # Giacenza totale per combinazione completa calcolata con un'unica
+    # aggregazione (invece di una SUM per ogni riga del catalogo).  Le
+    # colonne sono normalizzate come nel confronto precedente: NULL e
+    # stringa vuota coincidono, il produttore viene confrontato senza
+    # spazi iniziali/finali e gli sfridi sono esclusi.
+    qty_by_combo: dict[str, int] = {}
+    try:
+        for qr_row in conn.execute(
+            "SELECT materiale, COALESCE(tipo,''), COALESCE(spessore,''), "
+            "COALESCE(dimensione_x,''), COALESCE(dimensione_y,''), TRIM(COALESCE(produttore,'')), "
+            "SUM(quantita) FROM materiali WHERE COALESCE(is_sfrido,0) != 1 "
+            "GROUP BY 1, 2, 3, 4, 5, 6"
+        ):
+            qty_by_combo[_ckey(*qr_row[:6])] = int(qr_row[6] or 0)
+    except sqlite3.Error:
+        qty_by_combo = {}
+    for row in catalog_rows:
+        mat = row['materiale']
+        tp = row['tipo']
+        sp = row['spessore']
+        combo_key = _ckey(mat, tp, sp, row['dx'], row['dy'], row['prod'])
+        # Escludi combinazioni attive
+        if combo_key in active_keys_ext:
+            continue
+        # Quantità totale per questa combinazione includendo il produttore
+        total_qty = qty_by_combo.get(combo_key, 0)
+        # Determina la soglia di riordino per la combinazione completa
+        th_val = threshold_map_ext.get(combo_key, None)
+        if th_val is None:
+            th_val = threshold_map_combo.get(_ckey(mat, tp, sp), DEFAULT_REORDER_THRESHOLD)
+        # Le soglie pari a zero escludono la combinazione dal conteggio.  Non
+        # vengono filtrate in SQL perché una soglia estesa a zero deve
+        # comunque prevalere su quella legacy o di default.  Soglie e
+        # giacenze sono già interi, convertiti in fase di caricamento.
+        if th_val and total_qty <= th_val:
+            count += 1
+    _reorder_count_cache.update(version=version, ts=time.monotonic(), count=count)
+    return count
+
+
 @app.route('/')
 def dashboard():
     """Pagina principale: elenco materiali con filtri, ricerca e ordinamento.
@@ -2686,7 +3232,20 @@ def dashboard():
     sfrido e migliorare la logica dei filtri affinché i bancali vengano
     mostrati anche quando le lastre figlie soddisfano i criteri di
     ricerca.
+
+    L'HTML generato viene riutilizzato per ``DASHBOARD_CACHE_TTL`` secondi
+    per la stessa query string e lo stesso utente, purché nel frattempo
+    nessuna richiesta abbia modificato i dati.
     """
+    # Le pagine con messaggi flash in sospeso non vengono servite dalla
+    # cache: il messaggio deve essere mostrato (e consumato) una sola volta.
+    cache_key = (request.query_string, session.get('user_id'))
+    use_cache = '_flashes' not in session
+    if use_cache:
+        cached = _dashboard_cache.get(cache_key)
+        if cached and cached[0] == _data_version and time.monotonic() - cached[1] < DASHBOARD_CACHE_TTL:
+            return cached[2]
+    cache_version = _data_version
     # Parametri di filtro e ricerca
     materiale_filtro = request.args.get('materiale', '').strip()
     # New filter for ``tipo`` (type of processing/material).  Retrieve from query string
@@ -2765,9 +3324,14 @@ def dashboard():
     REORDER_THRESHOLD, ALERT_THRESHOLD = load_thresholds()
 
     conn = get_db_connection()
+    # Tutte le letture della dashboard avvengono in un'unica transazione di
+    # sola lettura: SQLite acquisisce il lock (e lo snapshot WAL) una volta
+    # sola invece che per ogni istruzione, e i dati sono coerenti tra loro.
+    conn.execute("BEGIN")
     # Carica tutti i materiali per applicare filtri complessi in Python
     rows_all = conn.execute(
-        "SELECT * FROM materiali ORDER BY (parent_id IS NOT NULL), parent_id, id"
+        f"SELECT {', '.join(MATERIALI_DASHBOARD_COLUMNS)} FROM materiali "
+        "ORDER BY (parent_id IS NOT NULL), parent_id, id"
     ).fetchall()
 
     # Se l'utente ha specificato un ID di lastra, individua la riga
@@ -2829,8 +3393,8 @@ def dashboard():
     # Mappa delle lastre figlie per ciascun bancale
     children_map: dict[int, list[sqlite3.Row]] = {}
     for r in rows_all:
-        if r['parent_id']:
-            children_map.setdefault(r['parent_id'], []).append(r)
+        if r[COL_PARENT_ID]:
+            children_map.setdefault(r[COL_PARENT_ID], []).append(r)
 
     # Determina gli ID dei materiali attualmente prenotati e gli ID
     # dei bancali (o lastre indipendenti) da evidenziare.  Se una lastra
@@ -2844,10 +3408,10 @@ def dashboard():
     # rows_all include tutte le lastre e i bancali; identifichiamo le righe
     # prenotate e aggiungiamo l'ID del bancale o della lastra indipendente.
     for r in rows_all:
-        rid = r['id']
+        rid = r[COL_ID]
         try:
             if rid in reserved_ids:
-                parent_id = r['parent_id']
+                parent_id = r[COL_PARENT_ID]
                 if parent_id:
                     reserved_highlight_ids.add(int(parent_id))
                 else:
@@ -2867,45 +3431,34 @@ def dashboard():
     #   dimensione_x, dimensione_y, produttore) a tutti i documenti caricati
     #   per la relativa combinazione.  Gli elementi ``None`` o stringhe vuote
     #   vengono normalizzati a stringhe vuote per consentire il confronto.
-    docs = conn.execute(
-        "SELECT id, material_id, original_name, materiale, tipo, spessore, dimensione_x, dimensione_y, produttore "
-        "FROM documenti"
-    ).fetchall()
-    attachments_by_material_id: dict[int | None, list[sqlite3.Row]] = {}
-    # La chiave di attachments_by_combo è una tupla a 6 elementi comprendente il produttore
-    attachments_by_combo: dict[tuple[str, str, str, str, str, str], list[sqlite3.Row]] = {}
-    for d in docs:
-        # Associa documento a material_id (può essere 0 o NULL per documenti legati solo alla combinazione)
-        attachments_by_material_id.setdefault(d['material_id'], []).append(d)
-        # Costruisci chiave di combinazione normalizzando a stringa vuota i valori mancanti
-        combo_key = (
-            (d['materiale'] or ''),
-            (d['tipo'] or ''),
-            (d['spessore'] or ''),
-            (d['dimensione_x'] or ''),
-            (d['dimensione_y'] or ''),
-            (d['produttore'] or '')
-        )
-        attachments_by_combo.setdefault(combo_key, []).append(d)
+    # Le mappe sono condivise tra le richieste (vedi ``get_attachment_maps``).
+    attachments_by_material_id, attachments_by_combo = get_attachment_maps(conn)
 
     # Carica la mappa delle soglie di riordino per materiale/spessore.  Questa
     # struttura viene utilizzata più avanti per determinare se un materiale
-    # raggiunge la soglia di riordino.  Usiamo tuple (materiale, spessore) come
-    # chiavi.  Se la tabella non contiene record, il dizionario sarà vuoto e
+    # raggiunge la soglia di riordino.  Usiamo chiavi composite
+    # ``_ckey(materiale, spessore)``.  Se la tabella non contiene record, il dizionario sarà vuoto e
     # il valore di default verrà usato quando richiesto.
-    threshold_map: dict[tuple[str, str], int] = {}
+    # La stessa lettura popola anche ``threshold_map_combo`` (chiave
+    # materiale/tipo/spessore), usata più avanti per il contatore esteso,
+    # così la tabella delle soglie legacy viene letta una sola volta.
+    threshold_map: dict[str, int] = {}
+    threshold_map_combo: dict[str, int] = {}
     try:
         cur_thresholds = conn.execute(
-            f"SELECT materiale, spessore, threshold FROM {RIORDINO_SOGGIE_TABLE}"
+            f"SELECT materiale, COALESCE(tipo,'') AS tipo, COALESCE(spessore,'') AS spessore, threshold "
+            f"FROM {RIORDINO_SOGGIE_TABLE}"
         ).fetchall()
         for tr in cur_thresholds:
-            key = (tr['materiale'], tr['spessore'] or '')
             try:
-                threshold_map[key] = int(tr['threshold'])
+                th = int(tr['threshold'])
             except (ValueError, TypeError):
-                threshold_map[key] = DEFAULT_REORDER_THRESHOLD
+                th = DEFAULT_REORDER_THRESHOLD
+            threshold_map[_ckey(tr['materiale'], tr['spessore'])] = th
+            threshold_map_combo[_ckey(tr['materiale'], tr['tipo'], tr['spessore'])] = th
     except sqlite3.Error:
         threshold_map = {}
+        threshold_map_combo = {}
 
     # ------------------------------------------------------------------
     # Combinazioni manuali (anagrafica articoli)
@@ -2917,15 +3470,15 @@ def dashboard():
     # aggregate, per cui qui ignoriamo tale attributo.  In caso di
     # eccezioni la variabile rimane vuota e nessuna combinazione
     # verrà segnalata come da riordinare.
-    manual_keys: set[tuple[str, str]] = set()
+    manual_keys: set[str] = set()
     try:
         manual_rows = conn.execute(
             "SELECT materiale, spessore FROM articoli_catalogo"
         ).fetchall()
         for row in manual_rows:
             mat = row['materiale']
-            sp = (row['spessore'] or '').strip()
-            manual_keys.add((mat, sp))
+            sp = _s(row['spessore'])
+            manual_keys.add(_ckey(mat, sp))
     except sqlite3.Error:
         manual_keys = set()
 
@@ -2943,12 +3496,6 @@ def dashboard():
             return int(num) if num else 0
         except ValueError:
             return 0
-    def parse_quantita(q: object) -> int:
-        try:
-            return int(q) if q is not None else 0
-        except (ValueError, TypeError):
-            return 0
-
     def parse_ubicazione(u: str):
         """
         Parse a combined location value into a sortable tuple.
@@ -2997,11 +3544,13 @@ def dashboard():
     # sulla riga stessa che sulle sue eventuali lastre figlie.  Le
     # lastre figlie non vengono visualizzate direttamente nella
     # dashboard ma i bancali che contengono lastre corrispondenti
-    # devono essere inclusi.
-    display_rows: list[dict] = []
+    # devono essere inclusi.  Le righe vengono suddivise direttamente tra
+    # bancali e lastre indipendenti, che vengono ordinati separatamente.
+    pallets_list: list[dict] = []
+    independent_list: list[dict] = []
     for r in rows_all:
         # salta le lastre figlie; saranno considerate tramite i loro genitori
-        if r['parent_id']:
+        if r[COL_PARENT_ID]:
             continue
         # Applica il filtro vista tipologia
         # Determina la tipologia della riga.  A partire da questa versione,
@@ -3010,9 +3559,9 @@ def dashboard():
         # sempre e solo bancali nella dashboard.  Pertanto, la variabile
         # ``is_pallet`` viene calcolata considerando sia il flag del
         # database che l'assenza di un ``parent_id``.
-        is_pallet = bool(r['is_pallet']) or (r['parent_id'] is None)
-        is_sfrido = bool(r['is_sfrido'])
-        is_indipendente = (not is_pallet) and (not r['parent_id'])
+        is_pallet = bool(r[COL_IS_PALLET]) or (r[COL_PARENT_ID] is None)
+        is_sfrido = bool(r[COL_IS_SFRIDO])
+        is_indipendente = (not is_pallet) and (not r[COL_PARENT_ID])
         # Filtraggio per vista
         if view_filter == 'bancali' and not is_pallet:
             continue
@@ -3028,21 +3577,11 @@ def dashboard():
         # lastre con quantità bassa (anche se di norma le lastre figlie hanno sempre quantita=1).
         if view_filter in ('riordino', 'riordinare'):
             # Determina se questa riga (radice) soddisfa la condizione di riordino
-            try:
-                qty_val = int(r['quantita']) if r['quantita'] is not None else 0
-            except (ValueError, TypeError):
-                qty_val = 0
-            meets = qty_val <= REORDER_THRESHOLD
+            # ``quantita`` è normalizzata a intero da ``init_db``.
+            meets = r['quantita'] <= REORDER_THRESHOLD
             if not meets:
                 # se non soddisfa la condizione, verifica se almeno un figlio soddisfa
-                for child in children_map.get(r['id'], []):
-                    try:
-                        cqty = int(child['quantita']) if child['quantita'] is not None else 0
-                    except (ValueError, TypeError):
-                        cqty = 0
-                    if cqty <= REORDER_THRESHOLD:
-                        meets = True
-                        break
+                meets = any(child['quantita'] <= REORDER_THRESHOLD for child in children_map.get(r['id'], []))
             # Se la riga non soddisfa la soglia, escludila
             if not meets:
                 continue
@@ -3051,7 +3590,7 @@ def dashboard():
             # all'inizio della funzione.  Solo se la combinazione è
             # presente nel catalogo degli articoli mostriamo la riga in
             # questa vista "Da riordinare".
-            key_manual = (r['materiale'], r['spessore'] or '')
+            key_manual = _ckey(r['materiale'], r['spessore'] or '')
             if key_manual not in manual_keys:
                 continue
         # Filtraggio per materiale, fornitore, ubicazione e ricerca.  È
@@ -3069,38 +3608,40 @@ def dashboard():
             automaticamente esclusi dai criteri dimensionali, ma possono essere
             inclusi se almeno una lastra figlia soddisfa i filtri (vedi logica
             successiva nel costruttore dell'elenco).
+
+            Le colonne vengono lette per indice (costanti ``COL_*``).
             """
             # Filtro per materiale (scelta dal menu a tendina)
-            if materiale_filtro and row['materiale'] != materiale_filtro:
+            if materiale_filtro and row[COL_MATERIALE] != materiale_filtro:
                 return False
             # Filtro per tipo.  Confronta la colonna ``tipo`` (stringa o None) con il
             # valore selezionato dal menu a tendina.  Se l'utente ha
             # selezionato un tipo specifico e la riga non corrisponde, la
             # riga viene esclusa.  Normalizziamo eventuali ``None`` o
             # stringhe vuote a stringa vuota.
-            if tipo_filtro and ((row['tipo'] or '').strip() != tipo_filtro):
+            if tipo_filtro and (_s(row[COL_TIPO]) != tipo_filtro):
                 return False
             # Filtro ricerca parziale sul materiale (campo search)
-            if search and search.lower() not in (row['materiale'] or '').lower():
+            if search and search.lower() not in (row[COL_MATERIALE] or '').lower():
                 return False
             # Filtro per fornitore
-            if fornitore_filtro and (row['fornitore'] or '').strip() != fornitore_filtro:
+            if fornitore_filtro and _s(row[COL_FORNITORE]) != fornitore_filtro:
                 return False
             # Filtro per produttore
-            if produttore_filtro and (row['produttore'] or '').strip() != produttore_filtro:
+            if produttore_filtro and _s(row[COL_PRODUTTORE]) != produttore_filtro:
                 return False
             # Filtro ubicazione lettera/numero
-            if filtro_lettera and (row['ubicazione_lettera'] or '') != filtro_lettera:
+            if filtro_lettera and (row[COL_UBIC_LETTERA] or '') != filtro_lettera:
                 return False
             if filtro_numero:
                 try:
-                    if int(row['ubicazione_numero']) != int(filtro_numero):
+                    if int(row[COL_UBIC_NUMERO]) != int(filtro_numero):
                         return False
                 except (ValueError, TypeError):
                     return False
             # Filtro dimensioni con range o valore esatto. Convertiamo dimensione_x e dimensione_y in float se possibile.
-            dx_raw = row['dimensione_x']
-            dy_raw = row['dimensione_y']
+            dx_raw = row[COL_DIM_X]
+            dy_raw = row[COL_DIM_Y]
             try:
                 dx_val = float(str(dx_raw).replace(',', '.')) if dx_raw not in (None, '', 'None') else None
             except Exception:
@@ -3117,7 +3658,7 @@ def dashboard():
                     return False
             # Filtro spessore con range o valore esatto.
             if rng_sp is not None:
-                sp_raw = row['spessore']
+                sp_raw = row[COL_SPESSORE]
                 try:
                     sp_val = float(str(sp_raw).replace(',', '.')) if sp_raw not in (None, '', 'None') else None
                 except Exception:
@@ -3159,14 +3700,8 @@ def dashboard():
         # gli insiemi e li uniamo evitando duplicati.  Normalizziamo
         # l'assenza di valori a stringa vuota per generare la chiave.
         try:
-            mat_val = (new_row.get('materiale') or '')
-            tipo_val = (new_row.get('tipo') or '')
-            sp_val = (new_row.get('spessore') or '')
-            dx_val = (new_row.get('dimensione_x') or '')
-            dy_val = (new_row.get('dimensione_y') or '')
-            # Includiamo anche il produttore nella chiave per recuperare i documenti
-            prod_val = (new_row.get('produttore') or '')
-            combo_key = (mat_val, tipo_val, sp_val, dx_val, dy_val, prod_val)
+            # La chiave include anche il produttore per recuperare i documenti
+            combo_key = _combo_key(r)
             # Documenti caricati specificamente per questo ID di materiale
             docs_material = list(attachments_by_material_id.get(r['id'], []))
             # Documenti caricati per la combinazione dell'anagrafica articolo
@@ -3181,19 +3716,15 @@ def dashboard():
         except Exception:
             # In caso di errore, ripiega sul comportamento precedente
             new_row['attachments'] = attachments_by_material_id.get(r['id'], [])
-        display_rows.append(new_row)
+        if new_row['is_pallet']:
+            pallets_list.append(new_row)
+        else:
+            independent_list.append(new_row)
 
     # Ordina l'elenco in base alla scelta dell'utente mantenendo i gruppi
     # (bancali prima delle lastre indipendenti).  Per l'ordinamento per
     # spessore/quantità ordiniamo le lastre indipendenti.  I bancali sono
     # sempre mostrati prima e non vengono ordinati tra di loro.
-    pallets_list: list[dict] = []
-    independent_list: list[dict] = []
-    for r in display_rows:
-        if r['is_pallet']:
-            pallets_list.append(r)
-        else:
-            independent_list.append(r)
     reverse_sort = (sort_dir == 'desc')
     if sort_field:
         if sort_field == 'spessore':
@@ -3202,9 +3733,17 @@ def dashboard():
             # Build a combined location string for sorting; fall back gracefully
             key_func = lambda r: parse_ubicazione(r.get('ubicazione') or ((r.get('ubicazione_lettera') or '') + (str(r.get('ubicazione_numero')) if r.get('ubicazione_numero') is not None else '')))
         else:
-            key_func = lambda r: parse_quantita(r['quantita'])
-        independent_list.sort(key=key_func, reverse=reverse_sort)
-        pallets_list.sort(key=key_func, reverse=reverse_sort)
+            # ``quantita`` è già un intero (normalizzata da ``init_db``)
+            key_func = operator.itemgetter('quantita')
+        # La chiave di ordinamento viene calcolata una sola volta per riga e
+        # memorizzata nel dizionario, così entrambi gli ordinamenti la
+        # riutilizzano senza richiamare le funzioni di parsing.
+        for group in (pallets_list, independent_list):
+            for r in group:
+                r['_sort_key'] = key_func(r)
+        sort_key = operator.itemgetter('_sort_key')
+        independent_list.sort(key=sort_key, reverse=reverse_sort)
+        pallets_list.sort(key=sort_key, reverse=reverse_sort)
     # Ricombina l'elenco: bancali seguiti da lastre indipendenti
     final_rows = pallets_list + independent_list
 
@@ -3228,8 +3767,8 @@ def dashboard():
     low_stock_count = 0
     total_sfridi = 0
     # Mappa per sommare le quantità totali per ciascuna combinazione
-    aggregated_qty_map: dict[tuple[str, str], int] = {}
-    # Primo passaggio: calcola sfridi e somma le quantità delle righe radice
+    aggregated_qty_map: dict[str, int] = {}
+    # Unico passaggio: calcola sfridi, scorte basse e somma le quantità delle righe radice
     for r in final_rows:
         # Conta sfridi: se la riga è sfrido indipendente incrementa;
         # se il bancale contiene sfridi figli li conta separatamente
@@ -3243,6 +3782,9 @@ def dashboard():
         # quantità per la combinazione materiale/spessore.  La quantità del
         # bancale rappresenta già il numero di lastre contenute.
         if not r['parent_id']:
+            # Conteggio scorte basse per ogni riga radice (sfridi inclusi)
+            if r['quantita'] <= ALERT_THRESHOLD:
+                low_stock_count += 1
             # Ignora le lastre indipendenti contrassegnate come sfrido quando si
             # calcola la somma delle quantità per il riordino.  Il bancale che
             # contiene sfridi non viene considerato sfrido, quindi viene
@@ -3250,21 +3792,8 @@ def dashboard():
             # vengono saltate.
             if r['is_sfrido']:
                 continue
-            try:
-                qty_val = int(r['quantita']) if r['quantita'] is not None else 0
-            except (ValueError, TypeError):
-                qty_val = 0
-            key = (r['materiale'], r['spessore'] or '')
-            aggregated_qty_map[key] = aggregated_qty_map.get(key, 0) + qty_val
-    # Secondo passaggio: calcola numero di scorte basse per ogni riga radice
-    for r in final_rows:
-        if not r['parent_id']:
-            try:
-                qty_val = int(r['quantita']) if r['quantita'] is not None else 0
-            except (ValueError, TypeError):
-                qty_val = 0
-            if qty_val <= ALERT_THRESHOLD:
-                low_stock_count += 1
+            key = _ckey(r['materiale'], r['spessore'] or '')
+            aggregated_qty_map[key] = aggregated_qty_map.get(key, 0) + r['quantita']
     # Determina quali combinazioni richiedono riordino confrontando la
     # quantità aggregata con la soglia specifica.  A partire da questa
     # versione l'elenco dei riordini è limitato alle combinazioni
@@ -3277,16 +3806,15 @@ def dashboard():
     # da riordinare solo se presenti nell'anagrafica articoli.  La
     # variabile ``flagged_keys`` contiene i soli elementi che superano la
     # soglia e sono anche definiti manualmente.
-    flagged_keys: set[tuple[str, str]] = set()
-    for key, total_q in aggregated_qty_map.items():
-        threshold_val = threshold_map.get(key, DEFAULT_REORDER_THRESHOLD)
-        if key in manual_keys and total_q <= threshold_val:
-            flagged_keys.add(key)
+    flagged_keys: set[str] = {
+        key for key in aggregated_qty_map.keys() & manual_keys
+        if aggregated_qty_map[key] <= threshold_map.get(key, DEFAULT_REORDER_THRESHOLD)
+    }
     # Compila la lista degli ID dei bancali/lastre indipendenti da evidenziare.
     reorder_ids: list[int] = []
     for r in final_rows:
         if not r['parent_id']:
-            key = (r['materiale'], r['spessore'] or '')
+            key = _ckey(r['materiale'], r['spessore'] or '')
             if key in flagged_keys:
                 reorder_ids.append(r['id'])
     # ------------------------------------------------------------------
@@ -3303,156 +3831,8 @@ def dashboard():
     # iteriamo tutte le combinazioni definite nell'anagrafica articoli
     # includendo il produttore.  Ogni combinazione con giacenza
     # totale inferiore o uguale alla soglia viene conteggiata.
-    reorder_rows_count = 0
     try:
-        # Carica mappe delle soglie legacy per (materiale, tipo, spessore)
-        threshold_map_combo: dict[tuple[str, str, str], int] = {}
-        try:
-            th_rows = conn.execute(
-                f"SELECT materiale, COALESCE(tipo,'') AS tipo, COALESCE(spessore,'') AS spessore, threshold "
-                f"FROM {RIORDINO_SOGGIE_TABLE}"
-            ).fetchall()
-            for tr in th_rows:
-                key = (tr['materiale'], tr['tipo'] or '', tr['spessore'] or '')
-                try:
-                    threshold_map_combo[key] = int(tr['threshold'])
-                except (ValueError, TypeError):
-                    threshold_map_combo[key] = DEFAULT_REORDER_THRESHOLD
-        except sqlite3.Error:
-            threshold_map_combo = {}
-        # Carica mappe delle soglie estese per combinazione completa
-        threshold_map_ext: dict[tuple[str, str, str, str, str, str], int] = {}
-        try:
-            ext_rows = conn.execute(
-                "SELECT materiale, COALESCE(tipo,'') AS tipo, COALESCE(spessore,'') AS spessore, "
-                "COALESCE(dimensione_x,'') AS dx, COALESCE(dimensione_y,'') AS dy, COALESCE(produttore,'') AS prod, "
-                "threshold FROM riordino_soglie_ext"
-            ).fetchall()
-            for er in ext_rows:
-                k = (
-                    er['materiale'],
-                    er['tipo'] or '',
-                    er['spessore'] or '',
-                    (er['dx'] or '').strip(),
-                    (er['dy'] or '').strip(),
-                    (er['prod'] or '').strip(),
-                )
-                try:
-                    threshold_map_ext[k] = int(er['threshold'])
-                except (ValueError, TypeError):
-                    threshold_map_ext[k] = DEFAULT_REORDER_THRESHOLD
-        except sqlite3.Error:
-            threshold_map_ext = {}
-        # Recupera combinazioni attive (in accettazione e RDO) includendo produttore
-        active_keys_ext: set[tuple[str, str, str, str, str, str]] = set()
-        try:
-            act_rows = conn.execute(
-                "SELECT COALESCE(materiale,'') AS materiale, COALESCE(tipo,'') AS tipo, COALESCE(spessore,'') AS spessore, "
-                "COALESCE(dimensione_x,'') AS dx, COALESCE(dimensione_y,'') AS dy, COALESCE(produttore,'') AS prod "
-                "FROM riordini_accettazione"
-            ).fetchall()
-            for a in act_rows:
-                active_keys_ext.add((
-                    a['materiale'] or '',
-                    a['tipo'] or '',
-                    a['spessore'] or '',
-                    (a['dx'] or '').strip(),
-                    (a['dy'] or '').strip(),
-                    (a['prod'] or '').strip(),
-                ))
-            # Recupera combinazioni in RDO; campo produttori può contenere lista separata da virgole
-            rdo_rows_tmp = conn.execute(
-                "SELECT COALESCE(materiale,'') AS materiale, COALESCE(tipo,'') AS tipo, COALESCE(spessore,'') AS spessore, "
-                "COALESCE(dimensione_x,'') AS dx, COALESCE(dimensione_y,'') AS dy, "
-                "COALESCE(produttori,'') AS prods, COALESCE(produttore_scelto,'') AS prod_sel "
-                "FROM riordini_rdo"
-            ).fetchall()
-            for r in rdo_rows_tmp:
-                mat = (r['materiale'] or '')
-                tpv = (r['tipo'] or '')
-                spv = (r['spessore'] or '')
-                dxv = (r['dx'] or '').strip()
-                dyv = (r['dy'] or '').strip()
-                prod_sel = (r['prod_sel'] or '').strip()
-                if prod_sel:
-                    prod_list = [prod_sel]
-                else:
-                    prods_field = (r['prods'] or '')
-                    if prods_field:
-                        prod_list = [p.strip() for p in prods_field.split(',') if p and p.strip()]
-                        if not prod_list:
-                            prod_list = ['']
-                    else:
-                        prod_list = ['']
-                for p in prod_list:
-                    active_keys_ext.add((mat, tpv, spv, dxv, dyv, p or ''))
-        except sqlite3.Error:
-            active_keys_ext = set()
-        # Recupera tutte le combinazioni dell'anagrafica articoli includendo produttore
-        try:
-            catalog_rows = conn.execute(
-                "SELECT materiale, COALESCE(tipo,'') AS tipo, COALESCE(spessore,'') AS spessore, "
-                "COALESCE(dimensione_x,'') AS dx, COALESCE(dimensione_y,'') AS dy, COALESCE(produttore,'') AS prod "
-                "FROM articoli_catalogo"
-            ).fetchall()
-        except sqlite3.Error:
-            catalog_rows = []
-        seen_combos_ext: set[tuple[str, str, str, str, str, str]] = set()
-        for row in catalog_rows:
-            mat = row['materiale']
-            tp = (row['tipo'] or '')
-            sp = (row['spessore'] or '')
-            dx = (row['dx'] or '').strip()
-            dy = (row['dy'] or '').strip()
-            prod = (row['prod'] or '').strip()
-            combo_key = (mat, tp, sp, dx, dy, prod)
-            # Evita duplicati
-            if combo_key in seen_combos_ext:
-                continue
-            seen_combos_ext.add(combo_key)
-            # Escludi combinazioni attive
-            if combo_key in active_keys_ext:
-                continue
-            # Calcola la quantità totale per questa combinazione includendo il produttore
-            total_qty = 0
-            try:
-                qty_res = conn.execute(
-                    "SELECT SUM(quantita) AS tot FROM materiali WHERE materiale=? "
-                    "AND (tipo=? OR (tipo IS NULL AND ?='')) "
-                    "AND (spessore=? OR (spessore IS NULL AND ?='')) "
-                    "AND (dimensione_x=? OR (dimensione_x IS NULL AND ?='')) "
-                    "AND (dimensione_y=? OR (dimensione_y IS NULL AND ?='')) "
-                    "AND TRIM(COALESCE(produttore,'')) = ? "
-                    "AND (is_sfrido IS NULL OR is_sfrido != 1)",
-                    (
-                        mat,
-                        tp or None, tp,
-                        sp or None, sp,
-                        dx or None, dx,
-                        dy or None, dy,
-                        prod or '',
-                    )
-                ).fetchone()
-                total_qty = int(qty_res['tot'] or 0) if qty_res and qty_res['tot'] is not None else 0
-            except sqlite3.Error:
-                total_qty = 0
-            # Determina la soglia di riordino per la combinazione completa
-            th_val = threshold_map_ext.get(combo_key, None)
-            if th_val is None:
-                th_val = threshold_map_combo.get((mat, tp, sp), DEFAULT_REORDER_THRESHOLD)
-            try:
-                # Escludi soglie pari a zero
-                if int(th_val) == 0:
-                    continue
-            except Exception:
-                pass
-            # Se la giacenza è minore o uguale alla soglia, incrementa il contatore
-            try:
-                if int(total_qty) <= int(th_val):
-                    reorder_rows_count += 1
-            except Exception:
-                # Ignora conversioni errate
-                pass
+        reorder_rows_count = count_reorder_combinations(conn, threshold_map_combo)
     except Exception:
         # In caso di errore, usa il numero di combinazioni flagged (vecchio metodo) come fallback
         reorder_rows_count = len(flagged_keys)
@@ -3463,13 +3843,13 @@ def dashboard():
     # filtri di dimensione è specificato, andiamo a popolare l'elenco
     # `filtered_slabs` con tutti i record che non sono bancali e che
     # soddisfano le stesse condizioni applicate nella dashboard (row_matches).
-    filtered_slabs: list[dict] = []
+    filtered_slabs: list[sqlite3.Row] = []
     # Popola l'elenco delle lastre se l'utente ha specificato almeno un filtro dimensionale.
     if rng_x is not None or rng_y is not None:
         for r in rows_all:
             # Consideriamo solo le lastre (sia figlie che indipendenti). I
             # bancali stessi non vengono inclusi nell'elenco delle lastre.
-            if r['is_pallet']:
+            if r[COL_IS_PALLET]:
                 continue
             # Verifichiamo se la riga soddisfa tutti i filtri tramite
             # row_matches. Questo include i filtri dimensionali.
@@ -3478,15 +3858,35 @@ def dashboard():
             except Exception:
                 matches = False
             if matches:
-                filtered_slabs.append(dict(r))
+                filtered_slabs.append(r)
 
-    conn.close()
-    lettere = [chr(l) for l in range(ord('A'), ord('Z') + 1)]
-    numeri = list(range(1, 100))
-    materiali_list = get_materiali_vocabolario()
-    suppliers = get_fornitori_vocabolario()
-    produttori = get_produttori_vocabolario()
-    # Ottieni l'elenco dei tipi di lavorazione/materiale dal dizionario.  Ogni
+    # Genera l'elenco delle ubicazioni esistenti per il menu di spostamento.
+    # Esegue una query per recuperare tutte le combinazioni distinte di lettera e numero
+    # presenti nella tabella materiali.  I valori NULL vengono filtrati e la lista è
+    # ordinata alfabeticamente per lettera e numero.  In caso di errore, la lista resta vuota.
+    # Selezionando e ordinando le colonne nude (senza COALESCE, superfluo dopo
+    # il filtro IS NOT NULL) SQLite percorre direttamente l'indice
+    # ``idx_materiali_location`` senza B-tree temporaneo per DISTINCT/ORDER BY.
+    # La query usa la stessa connessione (e transazione) della dashboard.
+    try:
+        loc_rows = conn.execute(
+            "SELECT DISTINCT ubicazione_lettera AS L, ubicazione_numero AS N "
+            "FROM materiali WHERE ubicazione_lettera IS NOT NULL AND ubicazione_numero IS NOT NULL "
+            "ORDER BY ubicazione_lettera, ubicazione_numero"
+        ).fetchall()
+        location_options = [f"{row['L']}-{row['N']}" for row in loc_rows if row['L'] and row['N']]
+    except Exception:
+        location_options = []
+
+    # Chiude la transazione di lettura aperta all'inizio
+    conn.commit()
+    conn.close()
+    lettere = UBICAZIONE_LETTERE
+    numeri = UBICAZIONE_NUMERI
+    materiali_list = get_materiali_vocabolario()
+    suppliers = get_fornitori_vocabolario()
+    produttori = get_produttori_vocabolario()
+    # Ottieni l'elenco dei tipi di lavorazione/materiale dal dizionario.  Ogni
     # elemento è un dizionario con chiavi ``id`` e ``nome``; utilizziamo
     # direttamente l'elenco per popolare il menu a tendina del filtro "Tipo"
     # nella dashboard.  In caso di problemi (es. tabella assente) la
@@ -3498,52 +3898,40 @@ def dashboard():
     # ``attachments_by_material_id`` manteniamo la stessa variabile per
     # retrocompatibilità assegnandola direttamente.
     attachments_by_material = attachments_by_material_id
-
-    # Genera l'elenco delle ubicazioni esistenti per il menu di spostamento.
-    # Esegue una query per recuperare tutte le combinazioni distinte di lettera e numero
-    # presenti nella tabella materiali.  I valori NULL vengono filtrati e la lista è
-    # ordinata alfabeticamente per lettera e numero.  In caso di errore, la lista resta vuota.
-    try:
-        with get_db_connection() as conn_loc:
-            loc_rows = conn_loc.execute(
-                "SELECT DISTINCT COALESCE(ubicazione_lettera,'') AS L, COALESCE(ubicazione_numero,0) AS N "
-                "FROM materiali WHERE ubicazione_lettera IS NOT NULL AND ubicazione_numero IS NOT NULL "
-                "ORDER BY L, N"
-            ).fetchall()
-        location_options = [f"{row['L']}-{row['N']}" for row in loc_rows if row['L'] and row['N']]
-    except Exception:
-        location_options = []
     # Prepara una versione serializzabile dei materiali finali per la modalità
     # "semplifica".  Include i campi essenziali (materiale, tipo, spessore,
     # produttore, id, quantita, ubicazione_lettera, ubicazione_numero, is_sfrido)
     # per consentire il filtraggio lato client senza richiamare il server.
+    # Le righe provengono tutte dalla stessa SELECT a colonne fisse
+    # (``MATERIALI_DASHBOARD_COLUMNS``), quindi ogni chiave è sempre presente.
+    # La lista viene costruita con una list comprehension e serializzata in
+    # forma compatta (senza spazi dopo i separatori) per ridurre il peso
+    # della pagina.
     try:
-        materials_list_for_json = []
-        for r in final_rows:
-            # sqlite3.Row supporta accesso tipo dizionario, ma alcune chiavi
-            # potrebbero essere None; normalizziamo a stringhe vuote
-            materials_list_for_json.append({
+        materials_list_for_json = [
+            {
                 'id': int(r['id']),
                 'materiale': r['materiale'] or '',
                 'tipo': r['tipo'] or '',
                 'spessore': r['spessore'] or '',
                 'produttore': r['produttore'] or '',
-                'quantita': r['quantita'] if 'quantita' in r.keys() else 0,
+                'quantita': r['quantita'],
                 'ubicazione_lettera': r['ubicazione_lettera'] or '',
                 'ubicazione_numero': r['ubicazione_numero'] or '',
-                'is_sfrido': bool(r['is_sfrido']) if 'is_sfrido' in r.keys() else False,
+                'is_sfrido': bool(r['is_sfrido']),
                 # Indica se la riga è un bancale (pallet).  In caso di bancale la
                 # chiave parent_id sarà None.  Questo ci permette di creare
                 # correttamente il link "Dettagli bancale" nella ricerca rapida.
-                'is_pallet': bool(r['is_pallet']) if 'is_pallet' in r.keys() else False,
-                'parent_id': (int(r['parent_id']) if r['parent_id'] is not None else None) if 'parent_id' in r.keys() else None
-            })
-        import json
-        materials_json = json.dumps(materials_list_for_json)
+                'is_pallet': bool(r['is_pallet']),
+                'parent_id': int(r['parent_id']) if r['parent_id'] is not None else None
+            }
+            for r in final_rows
+        ]
+        materials_json = json.dumps(materials_list_for_json, separators=(',', ':'))
     except Exception:
         materials_json = '[]'
 
-    return render_template(
+    html = render_template(
         'dashboard.html',
         title='Magazzino',
         materiali=final_rows,
@@ -3589,6 +3977,49 @@ def dashboard():
         # JSON serializzato dei materiali per il filtro semplificato
         materials_json=materials_json
     )
+    if use_cache:
+        if len(_dashboard_cache) >= DASHBOARD_CACHE_MAX_ENTRIES:
+            _dashboard_cache.clear()
+        _dashboard_cache[cache_key] = (cache_version, time.monotonic(), html)
+    return html
+
+
+# Numero massimo di lastre inserite con un singolo INSERT multi-riga: con 13
+# parametri per riga restiamo sotto il limite storico di 999 variabili SQLite.
+CHILD_INSERT_CHUNK = 60
+
+# Testo SQL dell'inserimento delle lastre figlie, condiviso da tutti i percorsi
+# di add(): a parità di numero di righe la stringa è identica e la connessione
+# riusa lo statement già compilato dalla propria cache.
+CHILD_SLAB_ROW_SQL = '(?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, 0)'
+INSERT_CHILD_SLABS_SQL = (
+    "INSERT INTO materiali (materiale, tipo, dimensioni, dimensione_x, dimensione_y, spessore, quantita, ubicazione_lettera, ubicazione_numero, fornitore, produttore, note, parent_id, is_sfrido, is_pallet)"
+    " VALUES {rows} RETURNING *"
+)
+
+
+def insert_child_slabs(conn: sqlite3.Connection, values: tuple, count: int) -> list[sqlite3.Row]:
+    """Inserisce ``count`` lastre figlie identiche e restituisce i record creati.
+
+    ``values`` contiene, nell'ordine, materiale, tipo, dimensioni,
+    dimensione_x, dimensione_y, spessore, ubicazione_lettera,
+    ubicazione_numero, fornitore, produttore, note, parent_id e is_sfrido.
+    Invece di un INSERT per lastra viene eseguito un INSERT multi-riga
+    (``VALUES (...), (...), ...``) ogni ``CHILD_INSERT_CHUNK`` lastre.  I record
+    completi vengono restituiti da ``RETURNING *`` in ordine di ID, senza
+    doverli rileggere con una SELECT successiva.
+    """
+    created: list[sqlite3.Row] = []
+    remaining = count
+    while remaining > 0:
+        n = min(remaining, CHILD_INSERT_CHUNK)
+        rows = conn.execute(
+            INSERT_CHILD_SLABS_SQL.format(rows=','.join([CHILD_SLAB_ROW_SQL] * n)),
+            values * n
+        ).fetchall()
+        created.extend(sorted(rows, key=operator.itemgetter('id')))
+        remaining -= n
+    return created
 
 
 @app.route('/add', methods=['GET', 'POST'])
@@ -3610,16 +4041,8 @@ def add():
     queste verranno indicate sulla dashboard con un pallino rosso.
     """
     # Possibili ubicazioni per filtri
-    lettere = [chr(l) for l in range(ord('A'), ord('Z') + 1)]
-    numeri = list(range(1, 100))
-    # Carica l'elenco dei bancali esistenti (is_pallet=1) per consentire
-    # l'inserimento di lastre figlie. Sono ordinati per ID.
-    with get_db_connection() as conn:
-        pallets = conn.execute(
-            "SELECT id, ubicazione_lettera, ubicazione_numero, materiale, quantita FROM materiali WHERE is_pallet=1 ORDER BY id"
-        ).fetchall()
-    # Carica l'elenco dei tipi di lavorazione per popolare il menu a tendina
-    tipi_list = get_tipi_vocabolario()
+    lettere = UBICAZIONE_LETTERE
+    numeri = UBICAZIONE_NUMERI
     # Gestione precompilazione per accettazione: se arrivano parametri via GET
     acc_id_param = request.args.get('acc_id')
     q_parziale_param = request.args.get('q_parziale')
@@ -3735,63 +4158,64 @@ def add():
             flash('Compila tutti i campi obbligatori: materiale, tipo, dimensioni X/Y, spessore, fornitore, produttore e ubicazione.', 'danger')
             return redirect(url_for('add'))
 
-        # ------------------------------------------------------------------
-        # Gestione produttore non presente nel vocabolario
-        # Se l'utente ha specificato un produttore che non esiste ancora
-        # nel dizionario dei produttori, lo inseriamo automaticamente.
-        if produttore:
-            try:
-                with get_db_connection() as conn:
-                    # Verifica se esiste già un produttore con lo stesso nome (case sensitive)
-                    exists = conn.execute(
-                        f"SELECT 1 FROM {PRODUTTORE_TABLE} WHERE nome=? LIMIT 1",
+        # Tutte le letture e scritture dell'inserimento avvengono su un'unica
+        # connessione e in un'unica transazione (BEGIN IMMEDIATE acquisisce
+        # subito il lock in scrittura): un solo commit, e quindi un solo
+        # fsync, al termine dell'elaborazione.  In caso di errore viene
+        # eseguito il rollback di tutte le modifiche.
+        conn = get_db_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # ------------------------------------------------------------------
+            # Gestione produttore non presente nel vocabolario
+            # Se l'utente ha specificato un produttore che non esiste ancora
+            # nel dizionario dei produttori, lo inseriamo automaticamente.
+            if produttore:
+                try:
+                    # Il vincolo UNIQUE su nome (case sensitive) ignora i produttori già presenti
+                    conn.execute(
+                        f"INSERT OR IGNORE INTO {PRODUTTORE_TABLE} (nome) VALUES (?)",
                         (produttore,)
-                    ).fetchone()
-                    if not exists:
-                        conn.execute(
-                            f"INSERT INTO {PRODUTTORE_TABLE} (nome) VALUES (?)",
-                            (produttore,)
-                        )
-            except Exception:
-                # In caso di errore nell'accesso al database ignoriamo l'inserimento
-                pass
+                    )
+                except Exception:
+                    # In caso di errore nell'accesso al database ignoriamo l'inserimento
+                    pass
 
-        # Se il materiale non appartiene al vocabolario e l'utente ha richiesto esplicitamente di aggiungerlo, inseriscilo nel dizionario
-        if request.form.get('aggiungi_materiale_vocab'):
-            with get_db_connection() as conn:
-                try:
-                    conn.execute(f"INSERT INTO {VOCAB_TABLE} (nome) VALUES (?)", (materiale,))
+            # Se il materiale non appartiene al vocabolario e l'utente ha richiesto esplicitamente di aggiungerlo, inseriscilo nel dizionario
+            if request.form.get('aggiungi_materiale_vocab'):
+                # Se esiste già non facciamo nulla
+                cur_vocab = conn.execute(f"INSERT OR IGNORE INTO {VOCAB_TABLE} (nome) VALUES (?)", (materiale,))
+                if cur_vocab.rowcount:
+                    # Il nuovo materiale viene salvato subito, come avveniva con la
+                    # connessione dedicata: un rollback successivo non deve annullarlo
+                    # dopo che il messaggio è già stato mostrato.
+                    conn.commit()
                     flash('Materiale aggiunto al dizionario!', 'success')
-                except sqlite3.IntegrityError:
-                    # Se esiste già non facciamo nulla
-                    pass
-        # Prima di procedere con l'inserimento effettivo, verifica se si tratta di un
-        # nuovo ordine.  Se l'utente ha attivato il toggle "nuovo_ordine" nel
-        # formulario, non vengono creati i bancali/lastre immediatamente: invece
-        # viene registrata una riga nella tabella riordini_accettazione per
-        # tenere traccia dell'ordine in attesa di arrivo.  In tal caso saltiamo
-        # tutte le logiche successive di inserimento materiale e reindirizziamo
-        # alla pagina Riordini.
-        if request.form.get('nuovo_ordine'):
-            # Data di arrivo prevista dal form (obbligatoria se nuovo ordine è selezionato)
-            data_arrivo = request.form.get('data_arrivo', '').strip()
-            if not data_arrivo:
-                flash('Seleziona una data di arrivo prevista per il nuovo ordine.', 'danger')
-                return redirect(url_for('add'))
-            # Inserisci una riga di accettazione.  Usiamo la data corrente per
-            # identificare la creazione dell'ordine e salviamo la data prevista
-            # come data_arrivo.  La quantità totale corrisponde alla quantità
-            # indicata nel modulo e la quantità ricevuta inizialmente è zero.  Il
-            # numero_ordine viene lasciato NULL per indicare che si tratta di un
-            # ordine manuale.  Salviamo anche il fornitore, il produttore e
-            # l'ubicazione inserita dall'utente per precompilare la fase di
-            # accettazione.
-            try:
-                now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            except Exception:
-                now_str = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-            try:
-                with get_db_connection() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+            # Prima di procedere con l'inserimento effettivo, verifica se si tratta di un
+            # nuovo ordine.  Se l'utente ha attivato il toggle "nuovo_ordine" nel
+            # formulario, non vengono creati i bancali/lastre immediatamente: invece
+            # viene registrata una riga nella tabella riordini_accettazione per
+            # tenere traccia dell'ordine in attesa di arrivo.  In tal caso saltiamo
+            # tutte le logiche successive di inserimento materiale e reindirizziamo
+            # alla pagina Riordini.
+            if request.form.get('nuovo_ordine'):
+                # Data di arrivo prevista dal form (obbligatoria se nuovo ordine è selezionato)
+                data_arrivo = request.form.get('data_arrivo', '').strip()
+                if not data_arrivo:
+                    flash('Seleziona una data di arrivo prevista per il nuovo ordine.', 'danger')
+                    conn.commit()
+                    return redirect(url_for('add'))
+                # Inserisci una riga di accettazione.  Usiamo la data corrente per
+                # identificare la creazione dell'ordine e salviamo la data prevista
+                # come data_arrivo.  La quantità totale corrisponde alla quantità
+                # indicata nel modulo e la quantità ricevuta inizialmente è zero.  Il
+                # numero_ordine viene lasciato NULL per indicare che si tratta di un
+                # ordine manuale.  Salviamo anche il fornitore, il produttore e
+                # l'ubicazione inserita dall'utente per precompilare la fase di
+                # accettazione.
+                now_str = datetime.now().isoformat(sep=' ', timespec='seconds')
+                try:
                     conn.execute(
                         "INSERT INTO riordini_accettazione (data, materiale, tipo, spessore, dimensione_x, dimensione_y, quantita_totale, quantita_ricevuta, numero_ordine, fornitore, produttore, data_prevista, ubicazione_lettera, ubicazione_numero) "
                         "VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?)",
@@ -3811,52 +4235,71 @@ def add():
                             ubicazione_numero if ubicazione_numero else None,
                         ),
                     )
-                flash('Nuovo ordine creato. Sarà mostrato nella sezione di accettazione.', 'success')
-            except Exception as e:
-                # In caso di errore nella creazione dell'ordine mostriamo un messaggio
-                flash('Errore durante la creazione del nuovo ordine: {}'.format(e), 'danger')
-            # Reindirizza alla pagina riordini per visualizzare l'ordine in attesa di accettazione
-            return redirect(url_for('riordini'))
+                    flash('Nuovo ordine creato. Sarà mostrato nella sezione di accettazione.', 'success')
+                except Exception as e:
+                    # In caso di errore nella creazione dell'ordine mostriamo un messaggio
+                    flash('Errore durante la creazione del nuovo ordine: {}'.format(e), 'danger')
+                conn.commit()
+                # Reindirizza alla pagina riordini per visualizzare l'ordine in attesa di accettazione
+                return redirect(url_for('riordini'))
 
-        # Elenco degli ID delle lastre appena create da utilizzare per mostrare i QR
-        # Prima di procedere con l'inserimento effettivo verifichiamo se nella stessa
-        # ubicazione è presente un altro bancale con materiale differente.  In questo
-        # caso chiediamo all'utente di confermare l'override oppure di scegliere
-        # un'altra ubicazione.  Il flag ``confirm_override`` viene impostato dal
-        # template di conferma e ci consente di saltare questo controllo al secondo
-        # invio del modulo.
-        created_ids: list[int] = []
-
-        # Verifica se l'utente sta aggiungendo un nuovo bancale/lastre senza
-        # specificare un bancale padre. In tal caso controlliamo se esiste già
-        # un bancale in questa ubicazione con un materiale diverso.  Se sì e
-        # ``confirm_override`` non è impostato, mostriamo una pagina di
-        # conferma.  In caso di conferma continuiamo normalmente creando un
-        # nuovo bancale per il nuovo materiale nella stessa ubicazione.
-        confirm_override = request.form.get('confirm_override')
-        # Solo se non stiamo aggiungendo una lastra figlia (parent_id è None)
-        if not parent_id:
-            try:
-                with get_db_connection() as check_conn:
-                    row = check_conn.execute(
+            # Elenco degli ID delle lastre appena create da utilizzare per mostrare i QR
+            # Prima di procedere con l'inserimento effettivo verifichiamo se nella stessa
+            # ubicazione è presente un altro bancale con materiale differente.  In questo
+            # caso chiediamo all'utente di confermare l'override oppure di scegliere
+            # un'altra ubicazione.  Il flag ``confirm_override`` viene impostato dal
+            # template di conferma e ci consente di saltare questo controllo al secondo
+            # invio del modulo.
+            created_ids: list[int] = []
+            created_rows: list[sqlite3.Row] = []
+            # Valori comuni a tutte le lastre figlie create da questa richiesta: nei
+            # diversi percorsi cambia solo il bancale padre.
+            child_values = (
+                materiale,
+                tipo_val if tipo_val else None,
+                dimensioni,
+                dimensione_x,
+                dimensione_y,
+                spessore,
+                ubicazione_lettera,
+                ubicazione_numero,
+                fornitore,
+                produttore,
+                note,
+            )
+            # Vero se il bancale di destinazione viene creato da questa richiesta:
+            # in tal caso le sue uniche lastre sono quelle in ``created_ids``.
+            pallet_is_new = False
+
+            # Verifica se l'utente sta aggiungendo un nuovo bancale/lastre senza
+            # specificare un bancale padre. In tal caso controlliamo se esiste già
+            # un bancale in questa ubicazione con un materiale diverso.  Se sì e
+            # ``confirm_override`` non è impostato, mostriamo una pagina di
+            # conferma.  In caso di conferma continuiamo normalmente creando un
+            # nuovo bancale per il nuovo materiale nella stessa ubicazione.
+            confirm_override = request.form.get('confirm_override')
+            # Solo se non stiamo aggiungendo una lastra figlia (parent_id è None)
+            if not parent_id:
+                try:
+                    row = conn.execute(
                         "SELECT materiale FROM materiali WHERE is_pallet=1 AND ubicazione_lettera=? AND ubicazione_numero=? LIMIT 1",
                         (ubicazione_lettera, ubicazione_numero)
                     ).fetchone()
-                # Se trovata una ubicazione occupata da un materiale diverso e non è stato confermato l'override
-                if row and row[0] != materiale and not confirm_override:
-                    # Passiamo tutti i dati del form alla pagina di conferma in modo
-                    # da poterli ripristinare in caso l'utente decida di proseguire.
-                    form_data = request.form.to_dict(flat=True)
-                    return render_template(
-                        'conferma_ubicazione.html',
-                        existing_materiale=row[0],
-                        form_data=form_data
-                    )
-            except Exception:
-                # Se il controllo fallisce (es. tabella non esistente) proseguiamo con l'inserimento.
-                pass
+                    # Se trovata una ubicazione occupata da un materiale diverso e non è stato confermato l'override
+                    if row and row[0] != materiale and not confirm_override:
+                        # Passiamo tutti i dati del form alla pagina di conferma in modo
+                        # da poterli ripristinare in caso l'utente decida di proseguire.
+                        form_data = request.form.to_dict(flat=True)
+                        conn.commit()
+                        return render_template(
+                            'conferma_ubicazione.html',
+                            existing_materiale=row[0],
+                            form_data=form_data
+                        )
+                except Exception:
+                    # Se il controllo fallisce (es. tabella non esistente) proseguiamo con l'inserimento.
+                    pass
 
-        with get_db_connection() as conn:
             if parent_id:
                 # Regola: un bancale non può avere spessori diversi.
                 # Verifica che il bancale padre esista, sia marcato come pallet e abbia spessore coerente.
@@ -3866,44 +4309,26 @@ def add():
                     par_row = None
                 if not par_row or int(par_row['is_pallet'] or 0) != 1:
                     flash('Il bancale selezionato non è valido.', 'danger')
+                    conn.commit()
                     return redirect(url_for('add'))
                 parent_sp = (par_row['spessore'] or '').strip()
                 # Se il bancale ha già uno spessore assegnato e non coincide con quello corrente, mostra un errore.
                 if parent_sp and parent_sp != spessore:
                     flash('Regola violata: un bancale non può avere spessori diversi.', 'danger')
+                    conn.commit()
                     return redirect(url_for('add'))
-                # Se il bancale non ha ancora uno spessore assegnato, impostalo allo spessore corrente.
-                if not parent_sp and spessore:
-                    conn.execute("UPDATE materiali SET spessore=? WHERE id=?", (spessore, parent_id))
                 # Inserimento di una lastra figlia ad un bancale o ad una lastra indipendente.
                 # Creiamo il nuovo record figlio e associamo parent_id al materiale padre.
-                cur = conn.execute(
-                    "INSERT INTO materiali (materiale, tipo, dimensioni, dimensione_x, dimensione_y, spessore, quantita, ubicazione_lettera, ubicazione_numero, fornitore, produttore, note, parent_id, is_sfrido, is_pallet)"
-                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
-                    (
-                        materiale,
-                        tipo_val if tipo_val else None,
-                        dimensioni,
-                        dimensione_x,
-                        dimensione_y,
-                        spessore,
-                        1,
-                        ubicazione_lettera,
-                        ubicazione_numero,
-                        fornitore,
-                        produttore,
-                        note,
-                        parent_id,
-                        is_sfrido,
-                    )
-                )
-                new_id = cur.lastrowid
-                created_ids.append(new_id)
-                # Aggiorniamo la quantità del padre e contrassegniamolo come bancale.
-                # Se il padre era una singola lastra (is_pallet=0), lo trasformiamo in bancale (is_pallet=1).
+                new_children = insert_child_slabs(conn, child_values + (parent_id, is_sfrido), 1)
+                created_rows.extend(new_children)
+                # Un unico UPDATE sul padre: aggiorniamo la quantità sommando le lastre
+                # inserite, lo contrassegniamo come bancale (se era una singola lastra,
+                # is_pallet=0, lo trasformiamo in bancale) e, se il bancale non ha ancora
+                # uno spessore assegnato, lo impostiamo allo spessore corrente.
+                new_parent_sp = spessore if (not parent_sp and spessore) else None
                 conn.execute(
-                    "UPDATE materiali SET quantita = quantita + 1, is_pallet = 1 WHERE id = ?",
-                    (parent_id,)
+                    "UPDATE materiali SET quantita = quantita + ?, is_pallet = 1, spessore = COALESCE(?, spessore) WHERE id = ?",
+                    (len(new_children), new_parent_sp, parent_id)
                 )
                 flash('Lastra aggiunta al bancale con successo!', 'success')
             else:
@@ -3914,74 +4339,40 @@ def add():
                 # altrimenti creiamo un nuovo bancale separato per il nuovo materiale.
                 # Verifica se esiste già un bancale nella stessa ubicazione che corrisponde esattamente
                 # alla combinazione di materiale, tipo, spessore, fornitore e produttore specificata.
-                # Recupera tutti i bancali esistenti nella stessa ubicazione.
-                # In precedenza veniva selezionato solo il primo bancale (LIMIT 1),
-                # ma se in una singola ubicazione sono presenti più bancali con
-                # materiali diversi potremmo selezionare quello errato.  Qui
-                # recuperiamo tutti i bancali nell'ubicazione e valutiamo uno ad uno
-                # per trovare un match esatto tra materiale, tipo, spessore, fornitore
-                # e produttore.
-                pallet_rows = conn.execute(
-                    "SELECT id, materiale, tipo, spessore, fornitore, produttore "
-                    "FROM materiali WHERE is_pallet=1 AND ubicazione_lettera=? AND ubicazione_numero=? "
-                    "ORDER BY id",
-                    (ubicazione_lettera, ubicazione_numero)
-                ).fetchall()
-                use_existing_pallet = False
-                pallet_id = None
-                # Funzione di normalizzazione utilizzata per confrontare stringhe e gestire None/str vuota
-                def _norm(x) -> str:
-                    return str(x).strip() if x is not None else ''
-                # Itera su tutti i bancali in questa ubicazione
-                for pallet_row in pallet_rows:
-                    # Estrai i valori dal record esistente
-                    row_id = pallet_row['id'] if isinstance(pallet_row, sqlite3.Row) else pallet_row[0]
-                    row_materiale = pallet_row['materiale'] if isinstance(pallet_row, sqlite3.Row) else pallet_row[1]
-                    row_tipo = pallet_row['tipo'] if isinstance(pallet_row, sqlite3.Row) else pallet_row[2]
-                    row_spessore = pallet_row['spessore'] if isinstance(pallet_row, sqlite3.Row) else pallet_row[3]
-                    row_fornitore = pallet_row['fornitore'] if isinstance(pallet_row, sqlite3.Row) else pallet_row[4]
-                    row_produttore = pallet_row['produttore'] if isinstance(pallet_row, sqlite3.Row) else pallet_row[5]
-                    # Confronta ogni campo con il valore che stiamo inserendo; considera stringhe vuote e None equivalenti
-                    if (
-                        _norm(row_materiale) == _norm(materiale)
-                        and _norm(row_tipo) == _norm(tipo_val)
-                        and _norm(row_spessore) == _norm(spessore)
-                        and _norm(row_fornitore) == _norm(fornitore)
-                        and _norm(row_produttore) == _norm(produttore)
-                    ):
-                        use_existing_pallet = True
-                        pallet_id = row_id
-                        # Interrompe l'iterazione dopo aver trovato il primo match
-                        break
+                # Se in una singola ubicazione sono presenti più bancali con
+                # materiali diversi, il confronto viene eseguito direttamente in SQL
+                # su tutti i campi (spazi iniziali/finali ignorati, NULL e stringa
+                # vuota equivalenti) e viene scelto il primo bancale compatibile.
+                # ``ORDER BY +id`` mantiene lo stesso ordine ma impedisce a SQLite di
+                # preferire idx_materiali_is_pallet (già ordinato per id) a
+                # idx_materiali_pallet_at_loc, che restringe la ricerca all'ubicazione.
+                # Ricerca e incremento della quantità avvengono nello stesso
+                # statement: se nessun bancale corrisponde, RETURNING non
+                # restituisce righe e si procede con la creazione.
+                pallet_row = conn.execute(
+                    "UPDATE materiali SET quantita = quantita + ? WHERE id = ("
+                    "SELECT id FROM materiali WHERE is_pallet=1 AND ubicazione_lettera=? AND ubicazione_numero=? "
+                    "AND COALESCE(TRIM(materiale),'')=? AND COALESCE(TRIM(tipo),'')=? AND COALESCE(TRIM(spessore),'')=? "
+                    "AND COALESCE(TRIM(fornitore),'')=? AND COALESCE(TRIM(produttore),'')=? "
+                    "ORDER BY +id LIMIT 1) RETURNING id",
+                    (
+                        max(quantita, 1),
+                        ubicazione_lettera,
+                        ubicazione_numero,
+                        _s(materiale),
+                        _s(tipo_val),
+                        _s(spessore),
+                        _s(fornitore),
+                        _s(produttore),
+                    )
+                ).fetchone()
+                use_existing_pallet = pallet_row is not None
+                pallet_id = pallet_row['id'] if pallet_row else None
 
                 if use_existing_pallet:
-                    # Aggiorniamo la quantità del bancale esistente sommando il numero di lastre che stiamo aggiungendo.
-                    conn.execute(
-                        "UPDATE materiali SET quantita = quantita + ? WHERE id = ?",
-                        (max(quantita, 1), pallet_id)
-                    )
-                    # Inseriamo le nuove lastre come figli del bancale esistente.
-                    for _ in range(max(quantita, 1)):
-                        cur_child = conn.execute(
-                            "INSERT INTO materiali (materiale, tipo, dimensioni, dimensione_x, dimensione_y, spessore, quantita, ubicazione_lettera, ubicazione_numero, fornitore, produttore, note, parent_id, is_sfrido, is_pallet)"
-                            " VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, 0)",
-                            (
-                                materiale,
-                                tipo_val if tipo_val else None,
-                                dimensioni,
-                                dimensione_x,
-                                dimensione_y,
-                                spessore,
-                                ubicazione_lettera,
-                                ubicazione_numero,
-                                fornitore,
-                                produttore,
-                                note,
-                                pallet_id,
-                                is_sfrido,
-                            )
-                        )
-                        created_ids.append(cur_child.lastrowid)
+                    # La quantità del bancale esistente è già stata incrementata
+                    # dall'UPDATE precedente: inseriamo le nuove lastre come figli.
+                    created_rows.extend(insert_child_slabs(conn, child_values + (pallet_id, is_sfrido), max(quantita, 1)))
                     flash('Lastre aggiunte al bancale esistente!', 'success')
                 else:
                     # Non esiste un bancale nella stessa ubicazione: seguiamo la
@@ -4009,28 +4400,9 @@ def add():
                             )
                         )
                         pallet_id = cur.lastrowid
+                        pallet_is_new = True
                         # Inseriamo le lastre figlie e raccogliamo i loro ID
-                        for _ in range(quantita):
-                            cur_child = conn.execute(
-                                "INSERT INTO materiali (materiale, tipo, dimensioni, dimensione_x, dimensione_y, spessore, quantita, ubicazione_lettera, ubicazione_numero, fornitore, produttore, note, parent_id, is_sfrido, is_pallet)"
-                                " VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, 0)",
-                                (
-                                    materiale,
-                                    tipo_val if tipo_val else None,
-                                    dimensioni,
-                                    dimensione_x,
-                                    dimensione_y,
-                                    spessore,
-                                    ubicazione_lettera,
-                                    ubicazione_numero,
-                                    fornitore,
-                                    produttore,
-                                    note,
-                                    pallet_id,
-                                    is_sfrido,
-                                )
-                            )
-                            created_ids.append(cur_child.lastrowid)
+                        created_rows.extend(insert_child_slabs(conn, child_values + (pallet_id, is_sfrido), quantita))
                         flash('Bancale e lastre aggiunti con successo!', 'success')
                     else:
                         # Inserimento di una singola lastra indipendente
@@ -4062,57 +4434,23 @@ def add():
                             )
                         )
                         pallet_id = cur.lastrowid
+                        pallet_is_new = True
                         # Inseriamo le lastre figlie (una o più) con i valori di dimensione e
                         # spessore inseriti dall'utente. Ciascuna lastra avrà quantita=1 e
                         # riferimento al bancale appena creato.  Raccolti gli ID per mostrare
                         # successivamente i QR code.
-                        for _ in range(max(quantita, 1)):
-                            cur_child = conn.execute(
-                                "INSERT INTO materiali (materiale, tipo, dimensioni, dimensione_x, dimensione_y, spessore, quantita, ubicazione_lettera, ubicazione_numero, fornitore, produttore, note, parent_id, is_sfrido, is_pallet)"
-                                " VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, 0)",
-                                (
-                                    materiale,
-                                    tipo_val if tipo_val else None,
-                                    dimensioni,
-                                    dimensione_x,
-                                    dimensione_y,
-                                    spessore,
-                                    ubicazione_lettera,
-                                    ubicazione_numero,
-                                    fornitore,
-                                    produttore,
-                                    note,
-                                    pallet_id,
-                                    is_sfrido,
-                                )
-                            )
-                            created_ids.append(cur_child.lastrowid)
+                        created_rows.extend(insert_child_slabs(conn, child_values + (pallet_id, is_sfrido), max(quantita, 1)))
                         flash('Bancale e lastra aggiunti con successo!', 'success')
-            # Recuperiamo i record creati per la pagina di conferma QR
-            # Prima di leggere gli ID appena inseriti e registrare gli eventi
-            # eseguiamo un commit esplicito.  Senza questo commit i record
-            # appena aggiunti potrebbero non essere visibili da una nuova
-            # connessione utilizzata da ``log_slab_events`` e da altre query.
-            try:
-                conn.commit()
-            except Exception:
-                # Se il commit fallisce continuiamo comunque: l'uscita dal
-                # context manager eseguirà un commit automatico
-                pass
+            # I record creati (restituiti dagli INSERT) servono per la pagina di
+            # conferma QR e per lo storico.
+            created_ids = [r['id'] for r in created_rows]
             if created_ids:
-                placeholders = ','.join(['?'] * len(created_ids))
-                q = f"SELECT * FROM materiali WHERE id IN ({placeholders})"
-                rows = conn.execute(q, created_ids).fetchall()
-                # Registra gli eventi di aggiunta per ciascuna lastra creata (non bancale) in batch
-                events_to_add = []
-                for r in rows:
-                    try:
-                        is_pallet_val = int(r['is_pallet'] or 0)
-                    except Exception:
-                        is_pallet_val = 0
-                    if is_pallet_val == 1:
-                        continue
-                    events_to_add.append({
+                rows = created_rows
+                # Registra gli eventi di aggiunta per ciascuna lastra creata in batch.
+                # ``created_rows`` contiene solo lastre figlie (is_pallet=0): i bancali
+                # creati da questa richiesta non vi sono inclusi.
+                log_slab_events([
+                    {
                         'slab_id': r['id'],
                         'event_type': 'aggiunto',
                         'from_letter': None,
@@ -4128,16 +4466,16 @@ def add():
                         'produttore': r['produttore'],
                         'note': r['note'],
                         'nesting_link': None,
-                    })
-                if events_to_add:
-                    log_slab_events(events_to_add)
+                    }
+                    for r in rows
+                ], conn=conn)
                 # Una volta registrati gli eventi, memorizziamo anche gli ID delle
                 # lastre create nel database nascosto dedicato.  In questo modo
                 # l'identificativo di una lastra non verrà mai riutilizzato
-                # successivamente.  Eventuali errori vengono ignorati per non
-                # interrompere l'elaborazione dell'inserimento.
+                # successivamente.  La scrittura avviene in background (vedi
+                # ``queue_used_ids``) per non allungare la transazione.
                 try:
-                    record_used_ids(created_ids)
+                    queue_used_ids(created_ids)
                 except Exception:
                     pass
                 # ------------------------------------------------------------------
@@ -4167,171 +4505,143 @@ def add():
                     except Exception:
                         pass
                     if dest_pallet_id:
-                        with get_db_connection() as doc_conn:
-                            # Recupera tutti i documenti caricati per la combinazione
-                            docs_combo = doc_conn.execute(
-                                "SELECT id, filename, original_name FROM documenti WHERE material_id=0 AND COALESCE(materiale,'')=? AND COALESCE(tipo,'')=? AND COALESCE(spessore,'')=? AND COALESCE(dimensione_x,'')=? AND COALESCE(dimensione_y,'')=? AND COALESCE(produttore,'')=?",
-                                (combo_materiale, combo_tipo, combo_spessore, combo_dx, combo_dy, combo_produttore)
-                            ).fetchall()
+                        # Recupera tutti i documenti caricati per la combinazione
+                        docs_combo = conn.execute(
+                            "SELECT id, filename, original_name FROM documenti WHERE material_id=0 AND COALESCE(materiale,'')=? AND COALESCE(tipo,'')=? AND COALESCE(spessore,'')=? AND COALESCE(dimensione_x,'')=? AND COALESCE(dimensione_y,'')=? AND COALESCE(produttore,'')=?",
+                            (combo_materiale, combo_tipo, combo_spessore, combo_dx, combo_dy, combo_produttore)
+                        ).fetchall()
+                        # Prepara l'insieme dei nomi originali dei documenti della combinazione
+                        combo_orig_names: set[str] = {
+                            doc_row['original_name'] for doc_row in docs_combo if doc_row['original_name']
+                        }
+                        # Senza documenti di combinazione non serve calcolare le lastre da aggiornare
+                        if docs_combo:
                             # Costruisci la lista di tutte le lastre figlie da aggiornare (nuove + esistenti)
                             child_ids_to_update: list[int] = []
                             # aggiungi le lastre appena create
                             for new_id in created_ids:
                                 if new_id not in child_ids_to_update:
                                     child_ids_to_update.append(new_id)
-                            # aggiungi le lastre già esistenti collegate al bancale
-                            try:
-                                existing_children = doc_conn.execute("SELECT id FROM materiali WHERE parent_id=?", (dest_pallet_id,)).fetchall()
-                            except Exception:
-                                existing_children = []
-                            for row in existing_children:
+                            # aggiungi le lastre già esistenti collegate al bancale (un bancale
+                            # appena creato contiene solo le lastre di ``created_ids``)
+                            existing_children = []
+                            if not pallet_is_new:
                                 try:
-                                    cid = row['id'] if isinstance(row, sqlite3.Row) else row[0]
+                                    existing_children = conn.execute("SELECT id FROM materiali WHERE parent_id=?", (dest_pallet_id,)).fetchall()
                                 except Exception:
-                                    continue
+                                    existing_children = []
+                            for row in existing_children:
+                                cid = row['id']
                                 if cid not in child_ids_to_update:
                                     child_ids_to_update.append(cid)
-                            # Prepara l'insieme dei nomi originali dei documenti della combinazione
-                            combo_orig_names: set[str] = set()
+                            # Replica ciascun documento della combinazione sul bancale e su ciascuna lastra.
+                            # Le copie sono hard link al file sorgente (niente riscrittura del
+                            # contenuto per ogni lastra), mentre le righe di ``documenti``
+                            # vengono raccolte e inserite con un unico executemany.
+                            doc_rows: list[tuple] = []
                             for doc_row in docs_combo:
+                                src_rel = doc_row['filename']
+                                original_name = doc_row['original_name']
+                                src_path = os.path.join(UPLOAD_FOLDER, src_rel)
+                                if not os.path.isfile(src_path):
+                                    continue
+                                _, ext = os.path.splitext(src_rel)
+                                ext = ext.lower()
+                                # Salva sul bancale come documento 'materiale'
                                 try:
-                                    oname = doc_row['original_name'] if isinstance(doc_row, sqlite3.Row) else doc_row[2]
+                                    rel_dest_p = link_file_to_id(src_path, ext, dest_pallet_id, doc_type='materiale')
+                                    doc_rows.append((dest_pallet_id, rel_dest_p, original_name))
                                 except Exception:
-                                    oname = None
-                                if oname:
-                                    combo_orig_names.add(oname)
-
-                            # Replica ciascun documento della combinazione sul bancale e su ciascuna lastra
-                            for doc_row in docs_combo:
-                                src_rel = doc_row['filename'] if isinstance(doc_row, sqlite3.Row) else doc_row[1]
-                                original_name = doc_row['original_name'] if isinstance(doc_row, sqlite3.Row) else doc_row[2]
-                                src_path = os.path.join(UPLOAD_FOLDER, src_rel)
+                                    pass
+                                # Salva su tutte le lastre figlie come documento 'pallet'.  Un errore
+                                # (es. disco pieno) interrompe solo la replica di questo documento.
                                 try:
-                                    with open(src_path, 'rb') as sf:
-                                        file_bytes = sf.read()
+                                    for cid in child_ids_to_update:
+                                        rel_dest_c = link_file_to_id(src_path, ext, cid, doc_type='pallet')
+                                        doc_rows.append((cid, rel_dest_c, original_name))
                                 except Exception:
+                                    pass
+                            if doc_rows:
+                                conn.executemany(
+                                    "INSERT INTO documenti (material_id, filename, original_name) VALUES (?, ?, ?)",
+                                    doc_rows
+                                )
+                        # Replica i documenti già presenti sul bancale su ogni nuova lastra appena creata, saltando quelli appena inseriti per la combinazione.
+                        # Un bancale appena creato ha solo i documenti appena copiati dalla combinazione.
+                        if created_ids and (docs_combo or not pallet_is_new):
+                            docs_parent = conn.execute(
+                                "SELECT id, filename, original_name FROM documenti WHERE material_id=?",
+                                (dest_pallet_id,)
+                            ).fetchall()
+                            doc_rows = []
+                            for doc_row in docs_parent:
+                                src_rel = doc_row['filename']
+                                original_name = doc_row['original_name']
+                                # Evita di duplicare i documenti appena replicati dalla combinazione
+                                if original_name in combo_orig_names:
+                                    continue
+                                src_path = os.path.join(UPLOAD_FOLDER, src_rel)
+                                if not os.path.isfile(src_path):
                                     continue
                                 _, ext = os.path.splitext(src_rel)
                                 ext = ext.lower()
-                                # Salva sul bancale come documento 'materiale'
                                 try:
-                                    rel_dest_p = save_file_to_id(file_bytes, ext, dest_pallet_id, doc_type='materiale')
-                                    doc_conn.execute(
-                                        "INSERT INTO documenti (material_id, filename, original_name) VALUES (?, ?, ?)",
-                                        (dest_pallet_id, rel_dest_p, original_name)
-                                    )
+                                    for cid in created_ids:
+                                        rel_dest = link_file_to_id(src_path, ext, cid, doc_type='pallet')
+                                        doc_rows.append((cid, rel_dest, original_name))
                                 except Exception:
                                     pass
-                                # Salva su tutte le lastre figlie come documento 'pallet'
-                                for cid in child_ids_to_update:
-                                    try:
-                                        rel_dest_c = save_file_to_id(file_bytes, ext, cid, doc_type='pallet')
-                                        doc_conn.execute(
-                                            "INSERT INTO documenti (material_id, filename, original_name) VALUES (?, ?, ?)",
-                                            (cid, rel_dest_c, original_name)
-                                        )
-                                    except Exception:
-                                        pass
-                            # Replica i documenti già presenti sul bancale su ogni nuova lastra appena creata, saltando quelli appena inseriti per la combinazione
-                            if created_ids:
-                                docs_parent = doc_conn.execute(
-                                    "SELECT id, filename, original_name FROM documenti WHERE material_id=?",
-                                    (dest_pallet_id,)
-                                ).fetchall()
-                                for doc_row in docs_parent:
-                                    src_rel = doc_row['filename'] if isinstance(doc_row, sqlite3.Row) else doc_row[1]
-                                    original_name = doc_row['original_name'] if isinstance(doc_row, sqlite3.Row) else doc_row[2]
-                                    # Evita di duplicare i documenti appena replicati dalla combinazione
-                                    try:
-                                        if original_name in combo_orig_names:
-                                            continue
-                                    except Exception:
-                                        pass
-                                    src_path = os.path.join(UPLOAD_FOLDER, src_rel)
-                                    try:
-                                        with open(src_path, 'rb') as sf:
-                                            file_bytes = sf.read()
-                                    except Exception:
-                                        continue
-                                    _, ext = os.path.splitext(src_rel)
-                                    ext = ext.lower()
-                                    for cid in created_ids:
-                                        try:
-                                            rel_dest = save_file_to_id(file_bytes, ext, cid, doc_type='pallet')
-                                            doc_conn.execute(
-                                                "INSERT INTO documenti (material_id, filename, original_name) VALUES (?, ?, ?)",
-                                                (cid, rel_dest, original_name)
-                                            )
-                                        except Exception:
-                                            pass
-                            try:
-                                doc_conn.commit()
-                            except Exception:
-                                pass
+                            if doc_rows:
+                                conn.executemany(
+                                    "INSERT INTO documenti (material_id, filename, original_name) VALUES (?, ?, ?)",
+                                    doc_rows
+                                )
                 except Exception:
                     pass
             else:
                 rows = []
-        # Aggiorna la riga di accettazione se l'inserimento deriva da una conferma
-        acc_id_form = request.form.get('acc_id')
-        if acc_id_form:
-            try:
-                acc_id_int = int(acc_id_form)
-            except (TypeError, ValueError):
-                acc_id_int = None
-            # Quantità totale da aggiornare, se fornita (può essere stringa)
-            acc_q_totale_new_raw = request.form.get('acc_q_totale_new')
-            new_total_val = None
-            if acc_q_totale_new_raw not in (None, '', 'None'):
+            # Aggiorna la riga di accettazione se l'inserimento deriva da una conferma
+            acc_id_form = request.form.get('acc_id')
+            if acc_id_form:
                 try:
-                    nt = int(acc_q_totale_new_raw)
-                    if nt > 0:
-                        new_total_val = nt
-                except (ValueError, TypeError):
-                    new_total_val = None
-            # Quantità effettivamente inserita con il form
-            try:
-                accepted_qty = int(request.form.get('quantita', '0'))
-            except (TypeError, ValueError):
-                accepted_qty = 0
-            with get_db_connection() as conn2:
-                # Assicurati che la tabella dei blocchi esista
+                    acc_id_int = int(acc_id_form)
+                except (TypeError, ValueError):
+                    acc_id_int = None
+                # Quantità totale da aggiornare, se fornita (può essere stringa)
+                acc_q_totale_new_raw = request.form.get('acc_q_totale_new')
+                new_total_val = None
+                if acc_q_totale_new_raw not in (None, '', 'None'):
+                    try:
+                        nt = int(acc_q_totale_new_raw)
+                        if nt > 0:
+                            new_total_val = nt
+                    except (ValueError, TypeError):
+                        new_total_val = None
+                # Quantità effettivamente inserita con il form
                 try:
-                    conn2.execute(
-                        "CREATE TABLE IF NOT EXISTS riordini_bloccati (\n"
-                        "  materiale TEXT NOT NULL,\n"
-                        "  tipo TEXT NOT NULL,\n"
-                        "  spessore TEXT NOT NULL,\n"
-                        "  dimensione_x TEXT NOT NULL,\n"
-                        "  dimensione_y TEXT NOT NULL,\n"
-                        "  blocked INTEGER DEFAULT 1,\n"
-                        "  PRIMARY KEY(materiale, tipo, spessore, dimensione_x, dimensione_y)\n"
-                        ")"
-                    )
-                except sqlite3.Error:
-                    pass
-                row = conn2.execute(
+                    accepted_qty = int(request.form.get('quantita', '0'))
+                except (TypeError, ValueError):
+                    accepted_qty = 0
+                row = conn.execute(
                     "SELECT * FROM riordini_accettazione WHERE id=?",
                     (acc_id_int,)
                 ).fetchone()
                 if row:
                     q_totale = int(row['quantita_totale'] or 0)
                     q_ricevuta = int(row['quantita_ricevuta'] or 0)
+                    # Le modifiche alla riga di accettazione vengono raccolte e applicate
+                    # con un unico UPDATE (o con il DELETE se la ricezione è completa).
+                    acc_set: list[str] = []
+                    acc_params: list = []
                     # Aggiorna totale se fornito
                     if new_total_val is not None:
                         q_totale = new_total_val
-                        conn2.execute(
-                            "UPDATE riordini_accettazione SET quantita_totale=? WHERE id=?",
-                            (q_totale, acc_id_int)
-                        )
+                        acc_set.append("quantita_totale=?")
+                        acc_params.append(q_totale)
 
                     # Aggiorna ricevuto con la quantità inserita
                     if accepted_qty > 0:
                         q_ricevuta += accepted_qty
-                        conn2.execute(
-                            "UPDATE riordini_accettazione SET quantita_ricevuta=? WHERE id=?",
-                            (q_ricevuta, acc_id_int)
-                        )
                         # Aggiorna fornitore, produttore e ubicazione per la riga di accettazione.
                         # Se fornitore e produttore sono stati specificati nel form, sovrascrivono i
                         # valori eventualmente presenti nella riga di accettazione.  L'ubicazione
@@ -4341,25 +4651,21 @@ def add():
                         # nel form utilizza i valori esistenti della riga di accettazione.
                         new_fornitore_val = fornitore if fornitore else (row['fornitore'] if row['fornitore'] else None)
                         new_produttore_val = produttore if produttore else (row['produttore'] if row['produttore'] else None)
-                        # Aggiorna la riga di accettazione con i nuovi valori e salva l'ubicazione solo se non già definita
-                        try:
-                            conn2.execute(
-                                "UPDATE riordini_accettazione SET fornitore=?, produttore=?, "
-                                "ubicazione_lettera = COALESCE(ubicazione_lettera, ?), "
-                                "ubicazione_numero = COALESCE(ubicazione_numero, ?) WHERE id=?",
-                                (
-                                    new_fornitore_val,
-                                    new_produttore_val,
-                                    ubicazione_lettera,
-                                    ubicazione_numero,
-                                    acc_id_int
-                                )
-                            )
-                        except sqlite3.Error:
-                            pass
+                        acc_set.append(
+                            "quantita_ricevuta=?, fornitore=?, produttore=?, "
+                            "ubicazione_lettera = COALESCE(ubicazione_lettera, ?), "
+                            "ubicazione_numero = COALESCE(ubicazione_numero, ?)"
+                        )
+                        acc_params.extend((
+                            q_ricevuta,
+                            new_fornitore_val,
+                            new_produttore_val,
+                            ubicazione_lettera,
+                            ubicazione_numero,
+                        ))
                         # Registra ogni accettazione (anche parziale) nello storico degli ordini
                         order_code = row['numero_ordine'] if 'numero_ordine' in row.keys() else None
-                        conn2.execute(
+                        conn.execute(
                             "INSERT INTO riordini_effettuati (material_id, data, quantita, materiale, tipo, spessore, fornitore, produttore, dimensione_x, dimensione_y, tipo_evento, numero_ordine) "
                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
                             (
@@ -4377,49 +4683,44 @@ def add():
                                 order_code
                             )
                         )
-                    conn2.commit()
                     # Se la ricezione è completa, rimuovi la riga di accettazione senza registrare un evento aggiuntivo.
                     # Gli eventi di accettazione parziale sono già stati registrati singolarmente.
                     if q_totale > 0 and q_ricevuta >= q_totale:
-                        # Elimina la riga di accettazione; la combinazione potrà riapparire per un nuovo riordino se necessario
-                        conn2.execute(
+                        # Elimina la riga di accettazione; la combinazione potrà riapparire per un nuovo riordino se necessario.
+                        # Gli aggiornamenti raccolti sopra non servono più.
+                        conn.execute(
                             "DELETE FROM riordini_accettazione WHERE id=?",
                             (acc_id_int,)
                         )
-                        conn2.commit()
                         flash('Ordine accettato completamente.', 'success')
                     else:
+                        if acc_set:
+                            conn.execute(
+                                f"UPDATE riordini_accettazione SET {', '.join(acc_set)} WHERE id=?",
+                                (*acc_params, acc_id_int)
+                            )
                         flash('Stato di accettazione aggiornato.', 'success')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
 
         # Se ci sono nuovi record, mostriamo la pagina con i QR; altrimenti torniamo alla dashboard
         if created_ids:
             # Costruiamo l'elenco degli ID come stringa separata da virgole per l'esportazione in PDF
-            pdf_ids = ','.join(str(i) for i in created_ids)
+            pdf_ids = ','.join(map(str, created_ids))
             # Costruiamo una mappa degli allegati per ciascuna lastra appena creata.
             # Questo consente di mostrare nella pagina "QR generati" un pulsante per la
             # gestione dei documenti con il conteggio degli allegati esistenti.
-            attachments_map: dict[int, list] = {}
             # Raccolta degli ID dei bancali a cui appartengono le lastre appena create
-            pallet_ids_set: set[int] = set()
-            for r in rows:
-                try:
-                    attachments_map[r['id']] = get_attachments(r['id'])
-                except Exception:
-                    attachments_map[r['id']] = []
-                # Se la lastra ha un parent_id, aggiungilo alla lista dei bancali
-                try:
-                    pid = r['parent_id']
-                    if pid:
-                        pallet_ids_set.add(pid)
-                except Exception:
-                    pass
+            pallet_ids_set: set[int] = {r['parent_id'] for r in rows if r['parent_id']}
+            # Gli allegati di lastre e bancali vengono letti con un'unica query
+            att_all = get_attachments_bulk(created_ids + sorted(pallet_ids_set))
+            attachments_map: dict[int, list] = {sid: att_all[sid] for sid in created_ids}
             # Costruisci la mappa degli allegati per ciascun bancale
-            attachments_pallet_map: dict[int, list] = {}
-            for pid in pallet_ids_set:
-                try:
-                    attachments_pallet_map[pid] = get_attachments(pid)
-                except Exception:
-                    attachments_pallet_map[pid] = []
+            attachments_pallet_map: dict[int, list] = {pid: att_all[pid] for pid in pallet_ids_set}
             # Converti il set di bancali in una lista ordinata per l'iterazione nel template
             pallet_ids = sorted(pallet_ids_set)
             return render_template(
@@ -4439,23 +4740,15 @@ def add():
     fornitori_list = get_fornitori_vocabolario()
     produttori_list = get_produttori_vocabolario()
     tipi_list = get_tipi_vocabolario()
-    # Recupera i valori distinti per dimensione X, Y e spessore per popolare i datalist.
+    # Elenco dei bancali esistenti (is_pallet=1, ordinati per ID) per consentire
+    # l'inserimento di lastre figlie; i valori distinti per dimensione X, Y e
+    # spessore dei datalist arrivano dalla cache dei vocabolari.  Queste letture
+    # servono solo al modulo, non all'invio (POST).
     with get_db_connection() as conn:
-        try:
-            dim_x_rows = conn.execute("SELECT DISTINCT dimensione_x FROM materiali WHERE dimensione_x IS NOT NULL AND TRIM(dimensione_x) != '' ORDER BY CAST(dimensione_x AS INT)").fetchall()
-            dimensione_x_list = [row['dimensione_x'] for row in dim_x_rows if row['dimensione_x'] is not None]
-        except sqlite3.Error:
-            dimensione_x_list = []
-        try:
-            dim_y_rows = conn.execute("SELECT DISTINCT dimensione_y FROM materiali WHERE dimensione_y IS NOT NULL AND TRIM(dimensione_y) != '' ORDER BY CAST(dimensione_y AS INT)").fetchall()
-            dimensione_y_list = [row['dimensione_y'] for row in dim_y_rows if row['dimensione_y'] is not None]
-        except sqlite3.Error:
-            dimensione_y_list = []
-        try:
-            sp_rows = conn.execute("SELECT DISTINCT spessore FROM materiali WHERE spessore IS NOT NULL AND TRIM(spessore) != '' ORDER BY CAST(spessore AS INT)").fetchall()
-            spessori_list = [row['spessore'] for row in sp_rows if row['spessore'] is not None]
-        except sqlite3.Error:
-            spessori_list = []
+        pallets = conn.execute(
+            "SELECT id, ubicazione_lettera, ubicazione_numero, materiale, quantita FROM materiali WHERE is_pallet=1 ORDER BY id"
+        ).fetchall()
+    dimensione_x_list, dimensione_y_list, spessori_list = get_dim_datalists()
     return render_template(
         'add.html',
         title='Aggiungi materiale',
@@ -4530,10 +4823,10 @@ def dettaglio(material_id: int):
     # Costruiamo una stringa di ID dei figli per la stampa multipla.  Se
     # ``children`` è vuoto la stringa risulterà vuota.
     child_ids = [child['id'] for child in children] if children else []
-    child_ids_str = ','.join(str(c) for c in child_ids)
+    child_ids_str = ','.join(map(str, child_ids))
     # Determina l'insieme delle lastre attualmente prenotate per disabilitare
     # il pulsante di prenotazione sulle lastre figlie.  Se si verifica
-    # un errore nella lettura del DB verrà passato un elenco vuoto al template.
+    # un errore nella lettura del DB verrà passato un insieme vuoto al template.
     try:
         reserved_ids_det = get_reserved_material_ids()
     except Exception:
@@ -4549,7 +4842,7 @@ def dettaglio(material_id: int):
         materiale=materiale,
         children=children_list,
         child_ids_str=child_ids_str,
-        reserved_ids=list(reserved_ids_det),
+        reserved_ids=reserved_ids_det,
         attachments=attachments,
         highlight_id=highlight_id
     )
@@ -4564,8 +4857,8 @@ def edit(material_id: int):
         conn.close()
         flash('Materiale non trovato!', 'danger')
         return redirect(url_for('dashboard'))
-    lettere = [chr(l) for l in range(ord('A'), ord('Z') + 1)]
-    numeri = list(range(1, 100))
+    lettere = UBICAZIONE_LETTERE
+    numeri = UBICAZIONE_NUMERI
     if request.method == 'POST':
         materiale_val = request.form.get('materiale', '').strip()
         tipo_val = request.form.get('tipo', '').strip()
@@ -4601,27 +4894,28 @@ def edit(material_id: int):
             "UPDATE materiali SET materiale=?, tipo=?, dimensioni=?, dimensione_x=?, dimensione_y=?, spessore=?, quantita=?, ubicazione_lettera=?, ubicazione_numero=?, fornitore=?, produttore=?, note=?, is_sfrido=? WHERE id=?",
             (materiale_val, tipo_val if tipo_val else None, dimensioni, dim_x, dim_y, spessore, quantita, ubicazione_lettera, ubicazione_numero, fornitore, produttore, note, is_sfrido, material_id)
         )
-        conn.commit()
-        conn.close()
+        # Gli eventi dello storico vengono raccolti e registrati con un'unica
+        # chiamata, nella stessa transazione dell'aggiornamento.
+        pending_events: list[dict] = []
         # Se la lastra era normale e ora è stata marcata come sfrido, registriamo l'evento
         try:
             if int(prev_is_sfrido or 0) == 0 and int(is_sfrido or 0) == 1:
-                log_slab_event(
-                    slab_id=material_id,
-                    event_type='sfrido',
-                    from_letter=materiale['ubicazione_lettera'],
-                    from_number=materiale['ubicazione_numero'],
-                    to_letter=materiale['ubicazione_lettera'],
-                    to_number=materiale['ubicazione_numero'],
-                    dimensione_x=dim_x or materiale['dimensione_x'],
-                    dimensione_y=dim_y or materiale['dimensione_y'],
-                    spessore=spessore or materiale['spessore'],
-                    materiale=materiale_val or materiale['materiale'],
-                    tipo=tipo_val or materiale['tipo'],
-                    fornitore=fornitore or materiale['fornitore'],
-                    produttore=produttore or materiale['produttore'],
-                    note=note
-                )
+                pending_events.append({
+                    'slab_id': material_id,
+                    'event_type': 'sfrido',
+                    'from_letter': materiale['ubicazione_lettera'],
+                    'from_number': materiale['ubicazione_numero'],
+                    'to_letter': materiale['ubicazione_lettera'],
+                    'to_number': materiale['ubicazione_numero'],
+                    'dimensione_x': dim_x or materiale['dimensione_x'],
+                    'dimensione_y': dim_y or materiale['dimensione_y'],
+                    'spessore': spessore or materiale['spessore'],
+                    'materiale': materiale_val or materiale['materiale'],
+                    'tipo': tipo_val or materiale['tipo'],
+                    'fornitore': fornitore or materiale['fornitore'],
+                    'produttore': produttore or materiale['produttore'],
+                    'note': note,
+                })
         except Exception:
             pass
         # Registra sempre un evento 'modificato' dopo l'aggiornamento (anche se sfrido).  Questo consente
@@ -4629,37 +4923,32 @@ def edit(material_id: int):
         # ubicazione o fornitori/produttori.  Usiamo come posizione di partenza le coordinate
         # precedenti e come destinazione le nuove coordinate.
         try:
-            # Convert the sqlite3.Row to a plain dict so we can safely use `.get()`.
-            try:
-                matd = dict(materiale)
-            except Exception:
-                # Fallback: build a dict using key access if direct conversion fails
-                matd = {k: materiale[k] for k in materiale.keys()} if materiale else {}
-            log_slab_events([
-                {
-                    'slab_id': material_id,
-                    'event_type': 'modificato',
-                    # Pre-move location comes from the previous values stored in the DB
-                    'from_letter': matd.get('ubicazione_lettera'),
-                    'from_number': matd.get('ubicazione_numero'),
-                    # Destination location uses the new values submitted via the form
-                    'to_letter': ubicazione_lettera,
-                    'to_number': ubicazione_numero,
-                    # For each attribute, prefer the new value if provided, falling back to the old one
-                    'dimensione_x': dim_x or matd.get('dimensione_x'),
-                    'dimensione_y': dim_y or matd.get('dimensione_y'),
-                    'spessore': spessore or matd.get('spessore'),
-                    'materiale': materiale_val or matd.get('materiale'),
-                    'tipo': tipo_val or matd.get('tipo'),
-                    'fornitore': fornitore or matd.get('fornitore'),
-                    'produttore': produttore or matd.get('produttore'),
-                    'note': note or matd.get('note'),
-                    'nesting_link': None,
-                }
-            ])
+            pending_events.append({
+                'slab_id': material_id,
+                'event_type': 'modificato',
+                # Pre-move location comes from the previous values stored in the DB
+                'from_letter': materiale['ubicazione_lettera'],
+                'from_number': materiale['ubicazione_numero'],
+                # Destination location uses the new values submitted via the form
+                'to_letter': ubicazione_lettera,
+                'to_number': ubicazione_numero,
+                # For each attribute, prefer the new value if provided, falling back to the old one
+                'dimensione_x': dim_x or materiale['dimensione_x'],
+                'dimensione_y': dim_y or materiale['dimensione_y'],
+                'spessore': spessore or materiale['spessore'],
+                'materiale': materiale_val or materiale['materiale'],
+                'tipo': tipo_val or materiale['tipo'],
+                'fornitore': fornitore or materiale['fornitore'],
+                'produttore': produttore or materiale['produttore'],
+                'note': note or materiale['note'],
+                'nesting_link': None,
+            })
         except Exception:
             # If something goes wrong during history logging, swallow the exception to avoid interrupting user flow
             pass
+        log_slab_events(pending_events, conn=conn)
+        conn.commit()
+        conn.close()
         flash('Materiale modificato con successo!', 'success')
         return redirect(url_for('dettaglio', material_id=material_id))
     conn.close()
@@ -4689,53 +4978,39 @@ def aggiorna_quantita(material_id: int):
     except (ValueError, TypeError):
         nuova_quantita = 0
     # Aggiorna la quantità del materiale e registra l'evento di modifica.
+    # RETURNING restituisce la riga aggiornata per lo storico, che viene
+    # registrato sulla stessa connessione e con un unico commit.
     with get_db_connection() as conn:
-        conn.execute("UPDATE materiali SET quantita=? WHERE id=?", (nuova_quantita, material_id))
-        # Commit esplicito per assicurare visibilità dell'update nella query successiva
-        try:
-            conn.commit()
-        except Exception:
-            pass
-    # Recupera i dettagli aggiornati del materiale per registrare lo storico
-    try:
-        with get_db_connection() as conn2:
-            mat_row = conn2.execute("SELECT * FROM materiali WHERE id=?", (material_id,)).fetchone()
-    except Exception:
-        mat_row = None
-    # Registra l'evento di modifica solo se l'ID corrisponde a una lastra (non bancale)
-    if mat_row:
-        # Convert the returned sqlite3.Row to a dict for safe .get usage
-        try:
-            matd = dict(mat_row)
-        except Exception:
-            matd = {k: mat_row[k] for k in mat_row.keys()} if mat_row else {}
-        try:
-            is_p = int(matd.get('is_pallet') or 0)
-        except Exception:
-            is_p = 0
-        if is_p == 0:
+        mat_row = conn.execute(
+            "UPDATE materiali SET quantita=? WHERE id=? RETURNING *",
+            (nuova_quantita, material_id)
+        ).fetchone()
+        # Registra l'evento di modifica solo se l'ID corrisponde a una lastra (non bancale)
+        if mat_row:
             try:
+                is_p = int(mat_row['is_pallet'] or 0)
+            except Exception:
+                is_p = 0
+            if is_p == 0:
                 log_slab_events([
                     {
                         'slab_id': material_id,
                         'event_type': 'modificato',
-                        'from_letter': matd.get('ubicazione_lettera'),
-                        'from_number': matd.get('ubicazione_numero'),
-                        'to_letter': matd.get('ubicazione_lettera'),
-                        'to_number': matd.get('ubicazione_numero'),
-                        'dimensione_x': matd.get('dimensione_x'),
-                        'dimensione_y': matd.get('dimensione_y'),
-                        'spessore': matd.get('spessore'),
-                        'materiale': matd.get('materiale'),
-                        'tipo': matd.get('tipo'),
-                        'fornitore': matd.get('fornitore'),
-                        'produttore': matd.get('produttore'),
-                        'note': matd.get('note'),
+                        'from_letter': mat_row['ubicazione_lettera'],
+                        'from_number': mat_row['ubicazione_numero'],
+                        'to_letter': mat_row['ubicazione_lettera'],
+                        'to_number': mat_row['ubicazione_numero'],
+                        'dimensione_x': mat_row['dimensione_x'],
+                        'dimensione_y': mat_row['dimensione_y'],
+                        'spessore': mat_row['spessore'],
+                        'materiale': mat_row['materiale'],
+                        'tipo': mat_row['tipo'],
+                        'fornitore': mat_row['fornitore'],
+                        'produttore': mat_row['produttore'],
+                        'note': mat_row['note'],
                         'nesting_link': None,
                     }
-                ])
-            except Exception:
-                pass
+                ], conn=conn)
     flash('Quantità aggiornata!', 'success')
     return redirect(url_for('dettaglio', material_id=material_id))
 
@@ -4749,54 +5024,52 @@ def update_note(material_id: int):
     """
     # Recupera la nota inviata dal form
     note = request.form.get('note', '').strip()
-    # Aggiorna il record del materiale con la nuova nota
-    # e recupera il record aggiornato per eventuale log
+    # Aggiorna il record del materiale con la nuova nota; RETURNING restituisce
+    # il record aggiornato e l'evento viene registrato nella stessa transazione.
     with get_db_connection() as conn:
-        conn.execute("UPDATE materiali SET note=? WHERE id=?", (note, material_id))
-        # Commit esplicito per assicurare che l'update sia visibile subito
-        try:
-            conn.commit()
-        except Exception:
-            pass
-        # Recupera il record aggiornato per registrare lo storico
-        try:
-            mat_row = conn.execute("SELECT * FROM materiali WHERE id=?", (material_id,)).fetchone()
-        except Exception:
-            mat_row = None
-    # Registra un evento di modifica nello storico lastre
-    try:
+        mat_row = conn.execute(
+            "UPDATE materiali SET note=? WHERE id=? RETURNING *",
+            (note, material_id)
+        ).fetchone()
+        # Registra un evento di modifica nello storico lastre
         if mat_row:
-            # Converti la Row in un dizionario per uso comodo con .get()
-            try:
-                matd = dict(mat_row)
-            except Exception:
-                matd = {k: mat_row[k] for k in mat_row.keys()} if mat_row else {}
             log_slab_events([
                 {
                     'slab_id': material_id,
                     'event_type': 'modificato',
-                    'from_letter': matd.get('ubicazione_lettera'),
-                    'from_number': matd.get('ubicazione_numero'),
-                    'to_letter': matd.get('ubicazione_lettera'),
-                    'to_number': matd.get('ubicazione_numero'),
-                    'dimensione_x': matd.get('dimensione_x'),
-                    'dimensione_y': matd.get('dimensione_y'),
-                    'spessore': matd.get('spessore'),
-                    'materiale': matd.get('materiale'),
-                    'tipo': matd.get('tipo'),
-                    'fornitore': matd.get('fornitore'),
-                    'produttore': matd.get('produttore'),
-                    'note': note or matd.get('note'),
+                    'from_letter': mat_row['ubicazione_lettera'],
+                    'from_number': mat_row['ubicazione_numero'],
+                    'to_letter': mat_row['ubicazione_lettera'],
+                    'to_number': mat_row['ubicazione_numero'],
+                    'dimensione_x': mat_row['dimensione_x'],
+                    'dimensione_y': mat_row['dimensione_y'],
+                    'spessore': mat_row['spessore'],
+                    'materiale': mat_row['materiale'],
+                    'tipo': mat_row['tipo'],
+                    'fornitore': mat_row['fornitore'],
+                    'produttore': mat_row['produttore'],
+                    'note': note or mat_row['note'],
                     'nesting_link': None,
                 }
-            ])
-    except Exception:
-        # Ignora eventuali errori nel logging per non interrompere il flusso principale
-        pass
+            ], conn=conn)
     flash('Note aggiornate con successo!', 'success')
     return redirect(url_for('dettaglio', material_id=material_id))
 
 
+def _padded_in_params(ids: list[int]) -> tuple[str, list[int]]:
+    """Prepara i segnaposto per una clausola ``IN`` di lunghezza potenza di due.
+
+    La lista viene completata con ``-1`` (ID mai assegnato) fino alla potenza
+    di due successiva: in questo modo bancali con un numero diverso di lastre
+    producono poche varianti del testo SQL e la cache delle istruzioni
+    preparate di SQLite viene riutilizzata.
+    """
+    size = 1
+    while size < len(ids):
+        size *= 2
+    return ','.join('?' * size), list(ids) + [-1] * (size - len(ids))
+
+
 @app.route('/remove_material', methods=['POST'])
 def remove_material():
     """Elimina un materiale dal magazzino."""
@@ -4810,231 +5083,189 @@ def remove_material():
         flash('Errore nella rimozione.', 'danger')
         return redirect(url_for('dashboard'))
     with get_db_connection() as conn:
-        materiale = conn.execute("SELECT * FROM materiali WHERE id=?", (material_id,)).fetchone()
+        # Solo le colonne usate per i controlli e per lo storico della rimozione
+        materiale = conn.execute(
+            "SELECT id, is_pallet, parent_id, ubicazione_lettera, ubicazione_numero, dimensione_x, dimensione_y, "
+            "spessore, materiale, tipo, fornitore, produttore, note FROM materiali WHERE id=?",
+            (material_id,)
+        ).fetchone()
         if not materiale:
             flash('Materiale non trovato.', 'danger')
             return redirect(url_for('dashboard'))
-
-        # Flag che indica se, al termine, dovranno essere cancellate le prenotazioni specifiche
-        # per l'ID scansionato.  Per le prenotazioni generiche viene impostato a False poiché
-        # la cancellazione avviene separatamente.
-        remove_specific_reservations = True
-
-        # Se la lastra non è un bancale, verifica se può essere rimossa solo in presenza
-        # di una prenotazione (specifica o generica).  Se non esiste alcuna
-        # prenotazione corrispondente viene impedita la rimozione.
-        try:
-            is_pallet_flag = int(materiale['is_pallet'] or 0)
-        except Exception:
-            is_pallet_flag = 0
-        if is_pallet_flag == 0:
-            parent_id = materiale['parent_id']
-            allowed_generic = False
-            allowed_specific = False
-            gen_rows = []
-            # Verifica prenotazioni specifiche per l'ID corrente
+        # L'intera rimozione (prenotazioni, documenti, storico e materiali) avviene
+        # in un'unica transazione, confermata all'uscita dal blocco ``with``.
+        conn.execute("BEGIN IMMEDIATE")
+        # I file fisici dei documenti vengono eliminati solo dopo il commit, così
+        # un eventuale rollback non lascia righe ``documenti`` senza file.
+        files_to_remove: list[str] = []
+
+        # Un errore SQL in qualsiasi passaggio annulla l'intera rimozione
+        try:
+            # Flag che indica se, al termine, dovranno essere cancellate le prenotazioni specifiche
+            # per l'ID scansionato.  Per le prenotazioni generiche viene impostato a False poiché
+            # la cancellazione avviene separatamente.
+            remove_specific_reservations = True
+
+            # Se la lastra non è un bancale, verifica se può essere rimossa solo in presenza
+            # di una prenotazione (specifica o generica).  Se non esiste alcuna
+            # prenotazione corrispondente viene impedita la rimozione.
             try:
-                # Recupera solo le prenotazioni specifiche (is_generic=0) per la lastra corrente.  Le prenotazioni generiche
-                # vengono gestite separatamente più avanti.
-                spec_rows = conn.execute(
-                    f"SELECT id FROM {PRENOTAZIONI_TABLE} WHERE material_id=? AND is_generic=0",
+                is_pallet_flag = int(materiale['is_pallet'] or 0)
+            except Exception:
+                is_pallet_flag = 0
+            if is_pallet_flag == 0:
+                parent_id = materiale['parent_id']
+                allowed_generic = False
+                allowed_specific = False
+                gen_rows = []
+                # Una sola query recupera sia le prenotazioni specifiche (is_generic=0) per la
+                # lastra corrente sia quelle generiche (is_generic=1) sulle lastre dello stesso
+                # bancale; le righe vengono poi separate in base al flag.  Tra le generiche
+                # viene ordinata per prima quella della lastra scansionata (``preferred``).
+                pren_rows = conn.execute(
+                    f"""SELECT id, material_id, 0 AS is_generic, 1 AS preferred FROM {PRENOTAZIONI_TABLE}
+                        WHERE material_id=? AND is_generic=0
+                        UNION ALL
+                        SELECT p.id, p.material_id, 1, p.material_id=? FROM {PRENOTAZIONI_TABLE} p
+                        JOIN materiali m ON p.material_id = m.id
+                        WHERE p.is_generic=1 AND m.parent_id=?
+                        ORDER BY is_generic, preferred DESC, id""",
+                    (material_id, material_id, parent_id)
+                ).fetchall()
+                if any(not row['is_generic'] for row in pren_rows):
+                    allowed_specific = True
+                # Se non c'è una prenotazione specifica, verifica se c'è una prenotazione generica per il bancale
+                if not allowed_specific and parent_id:
+                    gen_rows = [row for row in pren_rows if row['is_generic']]
+                    if gen_rows:
+                        allowed_generic = True
+                # Se nessuna prenotazione corrisponde, blocca la rimozione
+                if not allowed_specific and not allowed_generic:
+                    flash('La lastra non è prenotata e non può essere rimossa tramite scansione.', 'warning')
+                    return redirect(url_for('dashboard'))
+                # Se c'è una prenotazione generica valida, elimina la relativa riga in prenotazioni
+                # e non cancellare le prenotazioni specifiche dell'ID scansionato più avanti.
+                if allowed_generic:
+                    # Se tra le prenotazioni generiche c'è quella relativa alla lastra attualmente
+                    # scansionata, rimuoviamo quella. Altrimenti eliminiamo la prima trovata.
+                    # L'ordinamento della query mette già in testa la prenotazione preferita.
+                    conn.execute(
+                        f"DELETE FROM {PRENOTAZIONI_TABLE} WHERE id=?",
+                        (gen_rows[0]['id'],)
+                    )
+                    # Non rimuovere le prenotazioni specifiche legate a questo ID quando si esegue la rimozione
+                    remove_specific_reservations = False
+            # Se è un bancale eliminiamo anche tutte le lastre figlie
+            if materiale['is_pallet']:
+                # Per i bancali rimuoviamo anche tutte le lastre figlie e i loro documenti
+                # Oltre a cancellare i record dei materiali, eliminiamo i file fisici e
+                # i record nella tabella documenti.
+                # Recupera gli ID delle lastre figlie
+                # Una sola lettura delle lastre figlie: gli ID servono per la rimozione,
+                # le altre colonne per lo storico.
+                cur_children = conn.execute(
+                    "SELECT id, is_pallet, ubicazione_lettera, ubicazione_numero, dimensione_x, dimensione_y, "
+                    "spessore, materiale, tipo, fornitore, produttore, note FROM materiali WHERE parent_id=?",
                     (material_id,)
                 ).fetchall()
-            except Exception:
-                spec_rows = []
-            if spec_rows:
-                allowed_specific = True
-            # Se non c'è una prenotazione specifica, verifica se c'è una prenotazione generica per il bancale
-            if not allowed_specific and parent_id:
-                try:
-                    gen_rows = conn.execute(
-                        f"""SELECT p.id, p.material_id FROM {PRENOTAZIONI_TABLE} p
-                            JOIN materiali m ON p.material_id = m.id
-                            WHERE p.is_generic=1 AND m.parent_id=?""",
-                        (parent_id,)
+                child_ids = [row['id'] for row in cur_children]
+                # Costruisci una lista di tutti i materiali da rimuovere (pallet + figli)
+                to_remove = child_ids + [material_id]
+                # Elimina i record dei documenti associati a questi materiali; RETURNING
+                # fornisce i file fisici da eliminare dopo il commit
+                placeholders, remove_params = _padded_in_params(to_remove)
+                if to_remove:
+                    docs = conn.execute(
+                        f"DELETE FROM documenti WHERE material_id IN ({placeholders}) RETURNING filename",
+                        remove_params
                     ).fetchall()
-                except Exception:
-                    gen_rows = []
-                if gen_rows:
-                    allowed_generic = True
-            # Se nessuna prenotazione corrisponde, blocca la rimozione
-            if not allowed_specific and not allowed_generic:
-                flash('La lastra non è prenotata e non può essere rimossa tramite scansione.', 'warning')
-                return redirect(url_for('dashboard'))
-            # Se c'è una prenotazione generica valida, elimina la relativa riga in prenotazioni
-            # e non cancellare le prenotazioni specifiche dell'ID scansionato più avanti.
-            if allowed_generic:
-                # Se tra le prenotazioni generiche c'è quella relativa alla lastra attualmente
-                # scansionata, rimuoviamo quella. Altrimenti eliminiamo la prima trovata.
-                target_pren_id = None
-                for row in gen_rows:
-                    try:
-                        if row['material_id'] == material_id:
-                            target_pren_id = row['id']
-                            break
-                    except Exception:
-                        continue
-                if target_pren_id is None:
-                    try:
-                        target_pren_id = gen_rows[0]['id']
-                    except Exception:
-                        target_pren_id = None
-                if target_pren_id is not None:
-                    try:
-                        conn.execute(
-                            f"DELETE FROM {PRENOTAZIONI_TABLE} WHERE id=?",
-                            (target_pren_id,)
-                        )
-                        conn.commit()
-                    except Exception:
-                        pass
-                # Non rimuovere le prenotazioni specifiche legate a questo ID quando si esegue la rimozione
-                remove_specific_reservations = False
-        # Se è un bancale eliminiamo anche tutte le lastre figlie
-        if materiale['is_pallet']:
-            # Per i bancali rimuoviamo anche tutte le lastre figlie e i loro documenti
-            # Oltre a cancellare i record dei materiali, eliminiamo i file fisici e
-            # i record nella tabella documenti.
-            # Recupera gli ID delle lastre figlie
-            cur_children = conn.execute("SELECT id FROM materiali WHERE parent_id=?", (material_id,)).fetchall()
-            child_ids = [row['id'] for row in cur_children]
-            # Costruisci una lista di tutti i materiali da rimuovere (pallet + figli)
-            to_remove = child_ids + [material_id]
-            # Recupera i documenti associati a questi materiali
-            if to_remove:
-                placeholders = ','.join(['?'] * len(to_remove))
-                docs = conn.execute(
-                    f"SELECT id, filename FROM documenti WHERE material_id IN ({placeholders})",
-                    to_remove
-                ).fetchall()
-                # Elimina i file fisici
-                for d in docs:
-                    file_path = os.path.join(UPLOAD_FOLDER, d['filename'])
+                    files_to_remove.extend(d['filename'] for d in docs)
+                # Prima di eliminare lastre e bancale registriamo gli eventi di rimozione per ogni lastra figlia
+                # I dettagli delle lastre figlie per lo storico sono già in ``cur_children``
+                # Crea un batch di eventi di rimozione per le lastre figlie (esclude i bancali)
+                events_rm_children: list[dict] = []
+                for info in cur_children:
                     try:
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
+                        is_p = int(info['is_pallet'] or 0)
                     except Exception:
-                        pass
-                # Elimina i record dei documenti
-                conn.execute(f"DELETE FROM documenti WHERE material_id IN ({placeholders})", to_remove)
-            # Prima di eliminare lastre e bancale registriamo gli eventi di rimozione per ogni lastra figlia
-            # Recuperiamo anche i dettagli delle lastre figlie per lo storico
-            detailed_children = []
-            if child_ids:
-                placeholders_det = ','.join(['?'] * len(child_ids))
-                det_rows = conn.execute(
-                    f"SELECT * FROM materiali WHERE id IN ({placeholders_det})",
-                    child_ids
-                ).fetchall()
-                for dr in det_rows:
-                    detailed_children.append(dict(dr))
-            # Crea un batch di eventi di rimozione per le lastre figlie (esclude i bancali)
-            events_rm_children: list[dict] = []
-            for info in detailed_children:
-                try:
-                    is_p = int(info.get('is_pallet') or 0)
-                except Exception:
-                    is_p = 0
-                if is_p == 1:
-                    continue
-                events_rm_children.append({
-                    'slab_id': info['id'],
-                    'event_type': 'rimosso',
-                    'from_letter': info.get('ubicazione_lettera'),
-                    'from_number': info.get('ubicazione_numero'),
-                    'to_letter': None,
-                    'to_number': None,
-                    'dimensione_x': info.get('dimensione_x'),
-                    'dimensione_y': info.get('dimensione_y'),
-                    'spessore': info.get('spessore'),
-                    'materiale': info.get('materiale'),
-                    'tipo': info.get('tipo'),
-                    'fornitore': info.get('fornitore'),
-                    'produttore': info.get('produttore'),
-                    'note': info.get('note'),
-                    'nesting_link': None,
-                })
-            if events_rm_children:
-                # Effettuiamo un commit prima di registrare gli eventi di rimozione. In questo modo
-                # eventuali modifiche pendenti sul database (come l'aggiornamento delle quantità del
-                # bancale) vengono rese visibili alla connessione utilizzata da log_slab_events.
-                try:
-                    conn.commit()
-                except Exception:
-                    pass
-                log_slab_events(events_rm_children)
-            # Rimuovi lastre figlie e il bancale
-            conn.execute("DELETE FROM materiali WHERE parent_id=?", (material_id,))
-            conn.execute("DELETE FROM materiali WHERE id=?", (material_id,))
-            # Cancella eventuali prenotazioni collegate al bancale e alle sue lastre
-            if to_remove:
-                placeholders_rm = ','.join(['?'] * len(to_remove))
-                conn.execute(
-                    f"DELETE FROM {PRENOTAZIONI_TABLE} WHERE material_id IN ({placeholders_rm})",
-                    to_remove
-                )
-            flash('Bancale e relative lastre rimossi con successo!', 'success')
-        else:
-            parent_id = materiale['parent_id']
-            # Rimuoviamo la singola lastra
-            # Se stiamo rimuovendo la lastra a fronte di una prenotazione specifica,
-            # cancelliamo prima le relative prenotazioni per evitare errori di foreign key.
-            if remove_specific_reservations:
-                try:
+                        is_p = 0
+                    if is_p == 1:
+                        continue
+                    events_rm_children.append({
+                        'slab_id': info['id'],
+                        'event_type': 'rimosso',
+                        'from_letter': info['ubicazione_lettera'],
+                        'from_number': info['ubicazione_numero'],
+                        'to_letter': None,
+                        'to_number': None,
+                        'dimensione_x': info['dimensione_x'],
+                        'dimensione_y': info['dimensione_y'],
+                        'spessore': info['spessore'],
+                        'materiale': info['materiale'],
+                        'tipo': info['tipo'],
+                        'fornitore': info['fornitore'],
+                        'produttore': info['produttore'],
+                        'note': info['note'],
+                        'nesting_link': None,
+                    })
+                # Gli eventi vengono registrati sulla stessa connessione, nella transazione della rimozione
+                log_slab_events(events_rm_children, conn=conn)
+                # Rimuovi lastre figlie e il bancale
+                conn.execute("DELETE FROM materiali WHERE parent_id=?", (material_id,))
+                conn.execute("DELETE FROM materiali WHERE id=?", (material_id,))
+                # Cancella eventuali prenotazioni collegate al bancale e alle sue lastre
+                if to_remove:
+                    conn.execute(
+                        f"DELETE FROM {PRENOTAZIONI_TABLE} WHERE material_id IN ({placeholders})",
+                        remove_params
+                    )
+                flash('Bancale e relative lastre rimossi con successo!', 'success')
+            else:
+                parent_id = materiale['parent_id']
+                # Rimuoviamo la singola lastra
+                # Se stiamo rimuovendo la lastra a fronte di una prenotazione specifica,
+                # cancelliamo prima le relative prenotazioni per evitare errori di foreign key.
+                if remove_specific_reservations:
                     conn.execute(
                         f"DELETE FROM {PRENOTAZIONI_TABLE} WHERE material_id=?",
                         (material_id,)
                     )
-                except Exception:
-                    pass
-            # Prima eliminiamo eventuali documenti associati
-            docs = conn.execute("SELECT id, filename FROM documenti WHERE material_id=?", (material_id,)).fetchall()
-            for d in docs:
-                file_path = os.path.join(UPLOAD_FOLDER, d['filename'])
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                except Exception:
-                    pass
-            conn.execute("DELETE FROM documenti WHERE material_id=?", (material_id,))
-            # Registriamo l'evento di rimozione per la lastra tramite batch (singolo elemento)
-            try:
-                # Commit prima di loggare per assicurare visibilità dei dati rimossi
-                try:
-                    conn.commit()
-                except Exception:
-                    pass
-                # Convert the sqlite3.Row to a plain dict for safe .get usage
-                try:
-                    matd = dict(materiale)
-                except Exception:
-                    matd = {k: materiale[k] for k in materiale.keys()} if materiale else {}
+                # Prima eliminiamo eventuali documenti associati
+                docs = conn.execute(
+                    "DELETE FROM documenti WHERE material_id=? RETURNING filename",
+                    (material_id,)
+                ).fetchall()
+                files_to_remove.extend(d['filename'] for d in docs)
+                # Registriamo l'evento di rimozione per la lastra tramite batch (singolo elemento),
+                # nella stessa transazione della rimozione
                 log_slab_events([
                     {
-                        'slab_id': matd.get('id') or materiale['id'],
+                        'slab_id': materiale['id'],
                         'event_type': 'rimosso',
-                        'from_letter': matd.get('ubicazione_lettera'),
-                        'from_number': matd.get('ubicazione_numero'),
+                        'from_letter': materiale['ubicazione_lettera'],
+                        'from_number': materiale['ubicazione_numero'],
                         'to_letter': None,
                         'to_number': None,
-                        'dimensione_x': matd.get('dimensione_x'),
-                        'dimensione_y': matd.get('dimensione_y'),
-                        'spessore': matd.get('spessore'),
-                        'materiale': matd.get('materiale'),
-                        'tipo': matd.get('tipo'),
-                        'fornitore': matd.get('fornitore'),
-                        'produttore': matd.get('produttore'),
-                        'note': matd.get('note'),
+                        'dimensione_x': materiale['dimensione_x'],
+                        'dimensione_y': materiale['dimensione_y'],
+                        'spessore': materiale['spessore'],
+                        'materiale': materiale['materiale'],
+                        'tipo': materiale['tipo'],
+                        'fornitore': materiale['fornitore'],
+                        'produttore': materiale['produttore'],
+                        'note': materiale['note'],
                         'nesting_link': None,
                     }
-                ])
-            except Exception:
-                pass
-            conn.execute("DELETE FROM materiali WHERE id=?", (material_id,))
-            # Se esiste un bancale padre decrementiamo il conteggio delle lastre
-            if parent_id:
-                conn.execute("UPDATE materiali SET quantita = CASE WHEN quantita > 0 THEN quantita - 1 ELSE 0 END WHERE id=?", (parent_id,))
-            flash('Lastra rimossa con successo!', 'success')
+                ], conn=conn)
+                conn.execute("DELETE FROM materiali WHERE id=?", (material_id,))
+                # Se esiste un bancale padre decrementiamo il conteggio delle lastre
+                if parent_id:
+                    conn.execute("UPDATE materiali SET quantita = CASE WHEN quantita > 0 THEN quantita - 1 ELSE 0 END WHERE id=?", (parent_id,))
+                flash('Lastra rimossa con successo!', 'success')
+        except sqlite3.Error as e:
+            conn.rollback()
+            flash('Errore durante la rimozione: {}'.format(e), 'danger')
+            return redirect(url_for('dashboard'))
         # NOTA: non azzeriamo più la sequenza AUTOINCREMENT di SQLite.
         # In precedenza, dopo l'eliminazione di un bancale o di una lastra
         # veniva rimossa l'entry corrispondente nella tabella interna
@@ -5047,6 +5278,13 @@ def remove_material():
         # Lasciando intatta la sequenza, l'opzione AUTOINCREMENT assicura
         # che gli ID continuino a crescere anche dopo eliminazioni,
         # preservando l'univocità nel tempo.
+    # Transazione confermata: eliminiamo i file fisici dei documenti rimossi
+    for filename in files_to_remove:
+        try:
+            os.unlink(os.path.join(UPLOAD_FOLDER, filename))
+        except OSError:
+            # File già assente o non eliminabile: la riga è comunque stata rimossa
+            pass
     return redirect(url_for('dashboard'))
 
 # ---------------------------------------------------------------------------
@@ -5090,6 +5328,21 @@ def material_info(material_id: int):
     return jsonify({'success': True, 'data': data})
 
 
+@lru_cache(maxsize=4096)
+def _qr_png_bytes(material_id: int) -> bytes:
+    """Restituisce il PNG del QR code di un materiale.
+
+    Il QR codifica solo l'ID, quindi l'immagine non cambia mai per lo stesso
+    materiale e può essere generata una sola volta per processo.
+    """
+    qr = qrcode.QRCode(box_size=10, border=2)
+    qr.add_data(str(material_id))
+    qr_img = qr.make_image(fill_color='black', back_color='white').convert('RGB')
+    buf = BytesIO()
+    qr_img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
 @app.route('/qr/<int:material_id>')
 def qr_code(material_id: int):
     """Genera e restituisce l'immagine PNG del solo codice QR per un materiale.
@@ -5100,13 +5353,14 @@ def qr_code(material_id: int):
     modo l'utente visualizza un'etichetta pulita e compatta, ma quando
     stampa ottiene un'etichetta completa con il codice univoco integrato.
     """
-    qr = qrcode.QRCode(box_size=10, border=2)
-    qr.add_data(str(material_id))
-    qr_img = qr.make_image(fill_color='black', back_color='white').convert('RGB')
-    buf = BytesIO()
-    qr_img.save(buf, format='PNG')
-    buf.seek(0)
-    return send_file(buf, mimetype='image/png')
+    # L'immagine è invariante per ID: il browser può conservarla a lungo e
+    # rivalidarla tramite ETag.
+    return send_file(
+        BytesIO(_qr_png_bytes(material_id)),
+        mimetype='image/png',
+        max_age=31536000,
+        etag=f"qr-{material_id}",
+    )
 
 
 @app.route('/scan')
@@ -5142,7 +5396,8 @@ def sfrido_view(slab_id: int):
         return redirect(url_for('scan'))
     # Recupera l'ultimo evento noto per questo ID per ottenere le proprietà base
     info_row = conn.execute(
-        "SELECT * FROM slab_history WHERE slab_id=? ORDER BY id DESC LIMIT 1",
+        "SELECT materiale, tipo, spessore, fornitore, produttore, from_letter, from_number, dimensione_x, dimensione_y"
+        " FROM slab_history WHERE slab_id=? ORDER BY id DESC LIMIT 1",
         (slab_id,)
     ).fetchone()
     if not info_row:
@@ -5167,6 +5422,17 @@ def sfrido_view(slab_id: int):
     # Ubicazione originale: verrà registrata come "from_*" nell'evento sfrido
     from_letter = info.get('from_letter')
     from_number = info.get('from_number')
+    # Filtro SQL equivalente al confronto con ``_norm`` per individuare i bancali
+    # compatibili con la lastra originale direttamente nel database.  Le ricerche
+    # ordinano con ``ORDER BY +id`` così da usare idx_materiali_pallet_at_loc
+    # sull'ubicazione invece di scorrere tutti i bancali di idx_materiali_is_pallet.
+    compat_sql = (
+        "TRIM(COALESCE(materiale,''))=? AND TRIM(COALESCE(tipo,''))=? AND TRIM(COALESCE(spessore,''))=?"
+        " AND TRIM(COALESCE(fornitore,''))=? AND TRIM(COALESCE(produttore,''))=?"
+    )
+    compat_params = tuple(
+        _norm(v) for v in (base_materiale, base_tipo, base_spessore, base_fornitore, base_produttore)
+    )
     if request.method == 'POST':
         # Nuove dimensioni della lastra
         dim_x = request.form.get('dimensione_x', '').strip()
@@ -5231,32 +5497,25 @@ def sfrido_view(slab_id: int):
                     flash('Indicare l\'ubicazione (lettera e numero) per il nuovo bancale.', 'danger')
                     return redirect(request.url)
                 # Verifica se nella stessa ubicazione esiste già un bancale compatibile
-                pallet_rows = conn.execute(
-                    "SELECT id, materiale, tipo, spessore, fornitore, produttore, ubicazione_lettera, ubicazione_numero FROM materiali WHERE is_pallet=1 AND ubicazione_lettera=? AND ubicazione_numero=? ORDER BY id",
-                    (ubicazione_lettera, ubicazione_numero)
-                ).fetchall()
-                found_match = False
-                for pr in pallet_rows:
-                    if (
-                        _norm(pr['materiale']) == _norm(base_materiale)
-                        and _norm(pr['tipo']) == _norm(base_tipo)
-                        and _norm(pr['spessore']) == _norm(base_spessore)
-                        and _norm(pr['fornitore']) == _norm(base_fornitore)
-                        and _norm(pr['produttore']) == _norm(base_produttore)
-                    ):
-                        parent_id = pr['id']
-                        final_letter = pr['ubicazione_lettera']
-                        final_number = pr['ubicazione_numero']
-                        # Aggiorna la quantità del bancale compatibile
-                        try:
-                            conn.execute(
-                                "UPDATE materiali SET quantita = quantita + 1 WHERE id=?",
-                                (parent_id,)
-                            )
-                        except Exception:
-                            pass
-                        found_match = True
-                        break
+                pr = conn.execute(
+                    "SELECT id, ubicazione_lettera, ubicazione_numero FROM materiali"
+                    " WHERE is_pallet=1 AND ubicazione_lettera=? AND ubicazione_numero=? AND " + compat_sql +
+                    " ORDER BY +id LIMIT 1",
+                    (ubicazione_lettera, ubicazione_numero) + compat_params
+                ).fetchone()
+                found_match = pr is not None
+                if found_match:
+                    parent_id = pr['id']
+                    final_letter = pr['ubicazione_lettera']
+                    final_number = pr['ubicazione_numero']
+                    # Aggiorna la quantità del bancale compatibile
+                    try:
+                        conn.execute(
+                            "UPDATE materiali SET quantita = quantita + 1 WHERE id=?",
+                            (parent_id,)
+                        )
+                    except Exception:
+                        pass
                 if not found_match:
                     # Crea un nuovo bancale con le stesse caratteristiche.  La quantità iniziale è 1 poiché
                     # conterrà subito lo sfrido che stiamo aggiungendo.  Le dimensioni del bancale
@@ -5305,26 +5564,11 @@ def sfrido_view(slab_id: int):
                     parent_id,
                 )
             )
-            # Commit tutte le modifiche finora eseguite (aggiornamento/creazione
-            # del bancale e inserimento della nuova lastra sfrido) prima di
-            # registrare gli eventi.  In caso contrario, aprire una seconda
-            # connessione per il log potrebbe fallire con "database is locked"
-            # perché la transazione corrente tiene un lock di scrittura sul DB.
-            try:
-                conn.commit()
-            except Exception:
-                # anche se la commit fallisce continuiamo; eventuali eccezioni verranno gestite a valle
-                pass
-            # Chiudi la connessione principale prima di registrare gli eventi per rilasciare
-            # completamente il lock sul database.  Una volta chiusa la connessione, si utilizzerà
-            # una nuova connessione all'interno di ``log_slab_events``.
-            try:
-                conn.close()
-            except Exception:
-                pass
             # Registra gli eventi nello storico.  Registriamo sia l'aggiunta
             # (evento "aggiunto") sia l'evento specifico "sfrido" per
             # documentare completamente il cambiamento dello stato della lastra.
+            # Gli eventi vengono scritti sulla stessa connessione, nella transazione
+            # che ha aggiornato/creato il bancale e inserito lo sfrido.
             try:
                 log_slab_events([
                     {
@@ -5361,11 +5605,14 @@ def sfrido_view(slab_id: int):
                         'note': None,
                         'nesting_link': None,
                     }
-                ])
+                ], conn=conn)
             except Exception:
                 # Se il logging fallisce non interrompiamo il flusso; l'inserimento dello
                 # sfrido rimarrà comunque valido.
                 pass
+            # Un unico commit per bancale, sfrido ed eventi
+            conn.commit()
+            conn.close()
             flash('Sfrido creato con successo!', 'success')
             # Reindirizza alla pagina di dettaglio della nuova lastra sfrido
             return redirect(url_for('dettaglio', material_id=slab_id))
@@ -5389,23 +5636,19 @@ def sfrido_view(slab_id: int):
     previous_pallet_id = None
     previous_pallet_letter = None
     previous_pallet_number = None
-    for p in pallets:
-        try:
-            if (
-                p['ubicazione_lettera'] == from_letter
-                and p['ubicazione_numero'] == from_number
-                and _norm(p['materiale']) == _norm(base_materiale)
-                and _norm(p['tipo']) == _norm(base_tipo)
-                and _norm(p['spessore']) == _norm(base_spessore)
-                and _norm(p['fornitore']) == _norm(base_fornitore)
-                and _norm(p['produttore']) == _norm(base_produttore)
-            ):
-                previous_pallet_id = p['id']
-                previous_pallet_letter = p['ubicazione_lettera']
-                previous_pallet_number = p['ubicazione_numero']
-                break
-        except Exception:
-            pass
+    try:
+        prev = conn.execute(
+            "SELECT id, ubicazione_lettera, ubicazione_numero FROM materiali"
+            " WHERE is_pallet=1 AND ubicazione_lettera IS ? AND ubicazione_numero IS ? AND " + compat_sql +
+            " ORDER BY +id LIMIT 1",
+            (from_letter, from_number) + compat_params
+        ).fetchone()
+    except Exception:
+        prev = None
+    if prev:
+        previous_pallet_id = prev['id']
+        previous_pallet_letter = prev['ubicazione_lettera']
+        previous_pallet_number = prev['ubicazione_numero']
     conn.close()
     # Passa alla template le informazioni della lastra rimossa, l'elenco dei bancali e l'eventuale bancale precedente
     return render_template(
@@ -5428,33 +5671,37 @@ def sfrido_view(slab_id: int):
 @app.route('/export_csv')
 def export_csv():
     """Esporta l'inventario in formato CSV scaricabile."""
-    conn = get_db_connection()
-    materiali = conn.execute("SELECT * FROM materiali").fetchall()
-    conn.close()
+
+    class _Echo:
+        # Pseudo-buffer: ``csv.writer`` restituisce direttamente la riga formattata
+        def write(self, value):
+            return value
 
     def generate():
-        data = BytesIO()
-        writer = csv.writer(data)
+        writer = csv.writer(_Echo())
         # intestazioni
-        writer.writerow(['ID', 'Materiale', 'Dimensioni', 'Spessore', 'Quantità', 'Ubicazione', 'Fornitore', 'Produttore', 'Note'])
-        yield data.getvalue()
-        data.seek(0)
-        data.truncate(0)
-        for m in materiali:
-            writer.writerow([
-                m['id'],
-                m['materiale'],
-                m['dimensioni'],
-                m['spessore'],
-                m['quantita'],
-                f"{m['ubicazione_lettera']}-{m['ubicazione_numero']}",
-                m['fornitore'],
-                m['produttore'],
-                m['note']
-            ])
-            yield data.getvalue()
-            data.seek(0)
-            data.truncate(0)
+        yield writer.writerow(['ID', 'Materiale', 'Dimensioni', 'Spessore', 'Quantità', 'Ubicazione', 'Fornitore', 'Produttore', 'Note']).encode('utf-8')
+        # Le righe vengono lette dal cursore man mano che la risposta viene inviata,
+        # senza caricare l'intera tabella in memoria.
+        conn = get_db_connection()
+        try:
+            for m in conn.execute(
+                "SELECT id, materiale, dimensioni, spessore, quantita, ubicazione_lettera, ubicazione_numero, "
+                "fornitore, produttore, note FROM materiali"
+            ):
+                yield writer.writerow([
+                    m['id'],
+                    m['materiale'],
+                    m['dimensioni'],
+                    m['spessore'],
+                    m['quantita'],
+                    f"{m['ubicazione_lettera']}-{m['ubicazione_numero']}",
+                    m['fornitore'],
+                    m['produttore'],
+                    m['note']
+                ]).encode('utf-8')
+        finally:
+            conn.close()
     headers = {'Content-Disposition': 'attachment; filename="magazzino.csv"'}
     return Response(generate(), mimetype='text/csv', headers=headers)
 
@@ -5490,7 +5737,7 @@ def sfridi():
         reserved_ids_sfridi = get_reserved_material_ids()
     except Exception:
         reserved_ids_sfridi = set()
-    return render_template('sfridi.html', lastre=rows, reserved_ids=list(reserved_ids_sfridi))
+    return render_template('sfridi.html', lastre=rows, reserved_ids=reserved_ids_sfridi)
 
 @app.route('/riordini')
 def riordini():
@@ -5514,10 +5761,6 @@ def riordini():
     # stata completata e la combinazione è stata spostata nello storico, la
     # combinazione può ricomparire nei riordini se la giacenza scende di nuovo
     # sotto la soglia.  Pertanto non creiamo né consultiamo più questa tabella.
-    # Recupera tutte le righe radice (parent_id IS NULL)
-    rows = conn.execute(
-        "SELECT * FROM materiali WHERE parent_id IS NULL ORDER BY id"
-    ).fetchall()
     # Carica soglie e quantità di riordino da tabella legacy e dalla tabella estesa
     threshold_map: dict[tuple[str, str, str], int] = {}
     reorder_qty_map: dict[tuple[str, str, str], int | None] = {}
@@ -5655,6 +5898,54 @@ def riordini():
         ).fetchall()
     except sqlite3.Error:
         catalog_rows = []
+
+    # Quantità e bancali radice di tutte le combinazioni vengono letti con due sole query
+    # e indicizzati per chiave, invece di interrogare ``materiali`` per ogni riga del catalogo.
+    # Le chiavi replicano il confronto ``col=? OR (col IS NULL AND ?='')``: un valore NULL
+    # corrisponde alla stringa vuota del catalogo, mentre una stringa vuota memorizzata
+    # non corrisponde a nessuna combinazione.
+    def _combo_part(v):
+        return '' if v is None else (v if v != '' else None)
+
+    qty_map: dict[tuple[str, str, str, str, str, str], int] = {}
+    try:
+        for qr in conn.execute(
+            "SELECT materiale, tipo, spessore, dimensione_x, dimensione_y, "
+            "TRIM(COALESCE(produttore,'')) AS prod, SUM(quantita) AS tot FROM materiali "
+            "WHERE (is_sfrido IS NULL OR is_sfrido != 1) "
+            "GROUP BY materiale, tipo, spessore, dimensione_x, dimensione_y, prod"
+        ):
+            parts = tuple(_combo_part(qr[c]) for c in ('tipo', 'spessore', 'dimensione_x', 'dimensione_y'))
+            if None in parts or qr['tot'] is None:
+                continue
+            qty_map[(qr['materiale'], *parts, qr['prod'])] = int(qr['tot'])
+    except sqlite3.Error:
+        qty_map = {}
+    pallet_map: dict[tuple[str, str, str, str, str], list[dict]] = {}
+    try:
+        for pr in conn.execute(
+            "SELECT id, materiale, tipo, spessore, dimensione_x, dimensione_y, "
+            "COALESCE(ubicazione_lettera,'') || CAST(COALESCE(ubicazione_numero,0) AS INTEGER) AS ubicazione, "
+            "CAST(COALESCE(quantita,0) AS INTEGER) AS quantita "
+            "FROM materiali WHERE parent_id IS NULL "
+            "AND (is_sfrido IS NULL OR is_sfrido != 1) "
+            "ORDER BY COALESCE(ubicazione_lettera,''), COALESCE(ubicazione_numero,0)"
+        ):
+            parts = tuple(_combo_part(pr[c]) for c in ('tipo', 'spessore', 'dimensione_x', 'dimensione_y'))
+            if None in parts:
+                continue
+            # Ubicazione e quantità arrivano già nel formato da mostrare
+            pallet_map.setdefault((pr['materiale'], *parts), []).append({
+                'id': pr['id'],
+                'ubicazione': pr['ubicazione'],
+                'quantita': pr['quantita']
+            })
+    except sqlite3.Error:
+        pallet_map = {}
+    # Soglia e quantità di riordino risolte una sola volta per chiave, come coppie (S, R)
+    resolved_ext = {k: (v, reorder_qty_map_ext.get(k)) for k, v in threshold_map_ext.items()}
+    resolved_legacy = {k: (v, reorder_qty_map.get(k)) for k, v in threshold_map.items()}
+    default_threshold = DEFAULT_REORDER_THRESHOLD
     # Utilizza un set per evitare di elaborare più volte la stessa combinazione dal catalogo
     seen_combos: set[tuple[str, str, str, str, str, str]] = set()
     for row in catalog_rows:
@@ -5672,68 +5963,33 @@ def riordini():
         # Se la combinazione è attualmente in accettazione o in RDO, salta (verrà mostrata nella sezione dedicata)
         if combo_key in active_keys:
             continue
-        # Calcola la quantità totale per questa combinazione esatta dal magazzino.
+        # Quantità totale per questa combinazione esatta dal magazzino.
         # Sommiamo la quantità di tutte le righe (pallet radice o lastre figlie) con dimensioni
         # esattamente uguali.  Non filtriamo per parent_id in modo da replicare la
         # logica dell'anagrafica articoli, dove ogni combinazione (dimensione X/Y) è
         # trattata separatamente e non vi è sovrapposizione tra pallet radice e lastre figlie.
-        try:
-            # Calcola la quantità totale della combinazione includendo il produttore.
-            qty_res = conn.execute(
-                "SELECT SUM(quantita) AS tot FROM materiali WHERE materiale=? "
-                "AND (tipo=? OR (tipo IS NULL AND ?='')) "
-                "AND (spessore=? OR (spessore IS NULL AND ?='')) "
-                "AND (dimensione_x=? OR (dimensione_x IS NULL AND ?='')) "
-                "AND (dimensione_y=? OR (dimensione_y IS NULL AND ?='')) "
-                "AND TRIM(COALESCE(produttore,'')) = ? "
-                "AND (is_sfrido IS NULL OR is_sfrido != 1)",
-                (
-                    mat,
-                    tp or None, tp,
-                    sp or None, sp,
-                    dx or None, dx,
-                    dy or None, dy,
-                    prod or '',
-                )
-            ).fetchone()
-            total_qty = int(qty_res['tot'] or 0) if qty_res and qty_res['tot'] is not None else 0
-        except sqlite3.Error:
-            total_qty = 0
-        # Recupera la soglia per la combinazione.  Prima prova la mappa estesa,
-        # altrimenti usa la mappa legacy.
-        th_val = threshold_map_ext.get((mat, tp, sp, dx, dy, prod), None)
-        if th_val is None:
-            th_val = threshold_map.get((mat, tp, sp), DEFAULT_REORDER_THRESHOLD)
+        total_qty = qty_map.get(combo_key, 0)
+        # Soglia e quantità di riordino manuale (già convertite in interi, R None se assente
+        # o <=0): prima la mappa estesa, altrimenti quella legacy.
+        th_val, rq_manual = (
+            resolved_ext.get(combo_key)
+            or resolved_legacy.get((mat, tp, sp))
+            or (default_threshold, None)
+        )
         # SOGGLIA=0 => la combinazione NON va calcolata nei riordini
-        try:
-            if int(th_val) == 0:
-                continue
-        except Exception:
-            pass
-        # Quantità di riordino impostata manualmente (può essere None o <=0)
-        rq_manual_raw = None
-        # Prova la mappa estesa
-        if (mat, tp, sp, dx, dy, prod) in reorder_qty_map_ext:
-            rq_manual_raw = reorder_qty_map_ext.get((mat, tp, sp, dx, dy, prod))
-        else:
-            rq_manual_raw = reorder_qty_map.get((mat, tp, sp))
-        try:
-            rq_manual = int(rq_manual_raw) if rq_manual_raw not in (None, '') else None
-            if rq_manual is not None and rq_manual <= 0:
-                rq_manual = None
-        except Exception:
-            rq_manual = None
+        if th_val == 0:
+            continue
         # NUOVA LOGICA "Q.tà da ordinare":
         # se (Q + R) <= (S + 1) => ordina (S + 1) - Q; altrimenti ordina R
         # dove Q=quantità totale, R=quantità di riordino manuale, S=soglia
         rq = None
-        if int(total_qty) <= int(th_val):
+        if total_qty <= th_val:
             if rq_manual is None:
                 # Se non c'è R, usa direttamente (S + 1) - Q (>=1 perché Q <= S)
-                rq = (int(th_val) + 1) - int(total_qty)
+                rq = (th_val + 1) - total_qty
             else:
-                if (int(total_qty) + rq_manual) <= (int(th_val) + 1):
-                    rq = (int(th_val) + 1) - int(total_qty)
+                if (total_qty + rq_manual) <= (th_val + 1):
+                    rq = (th_val + 1) - total_qty
                 else:
                     rq = rq_manual
         else:
@@ -5744,29 +6000,8 @@ def riordini():
                 rq = None
         # Mostra la combinazione solo se la quantità totale è inferiore o uguale alla soglia
         if total_qty <= th_val:
-            # Raccogli elenco dei bancali radice interessati per questa combinazione
-            bancali_list: list[dict] = []
-            try:
-                pallet_rows = conn.execute(
-                    "SELECT id, COALESCE(ubicazione_lettera,'') AS lettera, COALESCE(ubicazione_numero,0) AS numero, COALESCE(quantita,0) AS quantita "
-                    "FROM materiali WHERE parent_id IS NULL AND materiale=? "
-                    "AND (tipo=? OR (tipo IS NULL AND ?='')) "
-                    "AND (spessore=? OR (spessore IS NULL AND ?='')) "
-                    "AND (dimensione_x=? OR (dimensione_x IS NULL AND ?='')) "
-                    "AND (dimensione_y=? OR (dimensione_y IS NULL AND ?='')) "
-                    "AND (is_sfrido IS NULL OR is_sfrido != 1) "
-                    "ORDER BY lettera, numero",
-                    (mat, tp or None, tp, sp or None, sp, dx or None, dx, dy or None, dy)
-                ).fetchall()
-                for pr in pallet_rows:
-                    num = '' if pr['numero'] is None else int(pr['numero'])
-                    bancali_list.append({
-                        'id': pr['id'],
-                        'ubicazione': f"{pr['lettera']}{num}",
-                        'quantita': int(pr['quantita'] or 0)
-                    })
-            except sqlite3.Error:
-                bancali_list = []
+            # Elenco dei bancali radice interessati per questa combinazione
+            bancali_list = pallet_map.get((mat, tp, sp, dx, dy), [])
             reorder_rows.append({
                 'materiale': mat,
                 'tipo': tp,
@@ -5781,9 +6016,8 @@ def riordini():
                 'key_id': abs(hash((mat, tp, sp, dx, dy, prod))) % 100000000
             })
 
-    # Costruisci lo storico dei riordini effettuati per visualizzarlo sotto la tabella.
-    # Verranno applicati filtri e paginazione in base ai parametri di query.
-    history: list[dict] = []
+    # Lo storico dei riordini effettuati viene filtrato e paginato direttamente in SQL
+    # più avanti, in base ai parametri di query.
     # In parallelo, raccogli i valori distinti per i filtri a tendina (materiale, tipo, spessore, dimensioni X/Y, evento).
     distinct_materiali: set[str] = set()
     distinct_tipi: set[str] = set()
@@ -5793,40 +6027,26 @@ def riordini():
     distinct_eventi: set[str] = set()
     # Raccogli anche i produttori distinti per filtrare lo storico ordini
     distinct_produttori: set[str] = set()
+    # Valori distinti (non vuoti) calcolati da SQLite con un'unica query
+    distinct_sets = {
+        'materiale': distinct_materiali,
+        'tipo': distinct_tipi,
+        'spessore': distinct_spessori,
+        'dimensione_x': distinct_dxs,
+        'dimensione_y': distinct_dys,
+        'tipo_evento': distinct_eventi,
+        'produttore': distinct_produttori,
+    }
     try:
-        hist_rows = conn.execute("SELECT * FROM riordini_effettuati ORDER BY datetime(data) DESC").fetchall()
-        for hr in hist_rows:
-            row_dict = dict(hr)
-            # Calcola flag confermato/accettato in base al tipo_evento
-            tipo_evento_val = (row_dict.get('tipo_evento') or '')
-            row_dict['confermato'] = True if tipo_evento_val == 'ordine' else False
-            row_dict['accettato'] = True if tipo_evento_val == 'accettazione' else False
-            # Popola set distinti
-            mval = (row_dict.get('materiale') or '').strip()
-            if mval:
-                distinct_materiali.add(mval)
-            tval = (row_dict.get('tipo') or '').strip()
-            if tval:
-                distinct_tipi.add(tval)
-            sval = (row_dict.get('spessore') or '').strip()
-            if sval:
-                distinct_spessori.add(sval)
-            dxv = (row_dict.get('dimensione_x') or '').strip()
-            if dxv:
-                distinct_dxs.add(dxv)
-            dyv = (row_dict.get('dimensione_y') or '').strip()
-            if dyv:
-                distinct_dys.add(dyv)
-            evv = tipo_evento_val.strip()
-            if evv:
-                distinct_eventi.add(evv)
-            # Raccogli valori distinti di produttore
-            pval = (row_dict.get('produttore') or '').strip()
-            if pval:
-                distinct_produttori.add(pval)
-            history.append(row_dict)
+        for col, val in conn.execute(
+            " UNION ".join(
+                f"SELECT '{col}', TRIM({col}) FROM riordini_effettuati WHERE TRIM(COALESCE({col},'')) <> ''"
+                for col in distinct_sets
+            )
+        ):
+            distinct_sets[col].add(val)
     except sqlite3.Error:
-        history = []
+        pass
 
     # Raccogli le righe ancora in accettazione per mostrarle prima dello storico.
     # Se mancano dimensioni X o Y, tenta di recuperarle dall'anagrafica articoli.
@@ -5985,77 +6205,77 @@ def riordini():
     evento_filter = request.args.get('evento_filter', '').strip()
     # Filtro per produttore nello storico
     produttore_filter = request.args.get('produttore_filter', '').strip()
-    # Filtra lo storico in base ai parametri
-    filtered_history: list[dict] = []
-    # Funzione ausiliaria per confronto case-insensitive contenuto
-    def matches(value: str | None, pattern: str) -> bool:
-        if not pattern:
-            return True
-        if value is None:
-            return False
-        return pattern.lower() in str(value).lower()
-    # Converti date di filtro (YYYY-MM-DD) in oggetti date
+    # Filtra lo storico in base ai parametri.  Le condizioni vengono tradotte in una
+    # clausola WHERE parametrizzata: i filtri testuali sono confronti "contiene"
+    # case-insensitive (anche per le lettere accentate, tramite ``py_lower``),
+    # l'evento è un confronto esatto.
+    where: list[str] = []
+    params: list = []
+    for col, pattern in (
+        ('materiale', materiale_filter),
+        ('tipo', tipo_filter),
+        ('spessore', spessore_filter),
+        # Filtra per dimensioni esatte (usa contains per semplicità)
+        ('dimensione_x', dx_filter),
+        ('dimensione_y', dy_filter),
+        ('produttore', produttore_filter),
+    ):
+        if pattern:
+            where.append(f"INSTR(py_lower({col}), ?) > 0")
+            params.append(pattern.lower())
+    if evento_filter:
+        where.append("COALESCE(tipo_evento,'') = ?")
+        params.append(evento_filter)
+    # Converti date di filtro (YYYY-MM-DD) in stringhe ISO confrontabili con ``datetime(data)``.
+    # Le righe con data non interpretabile non vengono escluse dal filtro per date.
     start_date_obj = None
     end_date_obj = None
     try:
         if start_date_str:
             start_date_obj = datetime.fromisoformat(start_date_str)
-    except Exception:
+    except ValueError:
         start_date_obj = None
     try:
         if end_date_str:
             # se l'utente fornisce solo data, consideriamo la fine della giornata
             end_date_obj = datetime.fromisoformat(end_date_str) + timedelta(days=1)
-    except Exception:
+    except ValueError:
         end_date_obj = None
-    for row in history:
-        # Filtra per date
-        # La colonna data è stringa ISO (YYYY-MM-DD HH:MM:SS), converti in datetime
-        include = True
-        if start_date_obj or end_date_obj:
-            try:
-                row_dt = datetime.fromisoformat(str(row.get('data')))
-            except Exception:
-                row_dt = None
-            if row_dt:
-                if start_date_obj and row_dt < start_date_obj:
-                    include = False
-                if end_date_obj and row_dt >= end_date_obj:
-                    include = False
-        # Filtra per attributi testo
-        if include and not matches(row.get('materiale'), materiale_filter):
-            include = False
-        if include and not matches(row.get('tipo'), tipo_filter):
-            include = False
-        if include and not matches(row.get('spessore'), spessore_filter):
-            include = False
-        # Filtra per dimensioni esatte (usa contains per semplicità)
-        if include and not matches(row.get('dimensione_x'), dx_filter):
-            include = False
-        if include and not matches(row.get('dimensione_y'), dy_filter):
-            include = False
-        # Filtra per produttore se specificato
-        if include and not matches(row.get('produttore'), produttore_filter):
-            include = False
-        # Filtra per tipo_evento se specificato
-        if include and evento_filter:
-            tev = (row.get('tipo_evento') or '')
-            if tev != evento_filter:
-                include = False
-        if include:
-            filtered_history.append(row)
+    if start_date_obj:
+        where.append("(datetime(data) IS NULL OR datetime(data) >= ?)")
+        params.append(start_date_obj.isoformat(sep=' '))
+    if end_date_obj:
+        where.append("(datetime(data) IS NULL OR datetime(data) < ?)")
+        params.append(end_date_obj.isoformat(sep=' '))
+    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
     # Calcola pagine
-    total_results = len(filtered_history)
+    try:
+        total_results = conn.execute(
+            f"SELECT COUNT(*) FROM riordini_effettuati{where_sql}", params
+        ).fetchone()[0]
+    except sqlite3.Error:
+        total_results = 0
     total_pages = (total_results + per_page - 1) // per_page if total_results > 0 else 1
     # Normalizza pagina richiesta
     if current_page < 1:
         current_page = 1
     if current_page > total_pages:
         current_page = total_pages
-    # Determina range di elementi da mostrare
-    start_idx = (current_page - 1) * per_page
-    end_idx = start_idx + per_page
-    history_paginated = filtered_history[start_idx:end_idx]
+    # Recupera solo le righe della pagina richiesta
+    history_paginated: list[dict] = []
+    try:
+        for hr in conn.execute(
+            f"SELECT * FROM riordini_effettuati{where_sql} ORDER BY datetime(data) DESC LIMIT ? OFFSET ?",
+            (*params, per_page, (current_page - 1) * per_page)
+        ):
+            row_dict = dict(hr)
+            # Calcola flag confermato/accettato in base al tipo_evento
+            tipo_evento_val = (row_dict.get('tipo_evento') or '')
+            row_dict['confermato'] = True if tipo_evento_val == 'ordine' else False
+            row_dict['accettato'] = True if tipo_evento_val == 'accettazione' else False
+            history_paginated.append(row_dict)
+    except sqlite3.Error:
+        history_paginated = []
 
     # Costruisci una struttura gerarchica padre-figlio per lo storico.
     # Ogni elemento dell'elenco risultante è un dizionario con le chiavi:
@@ -8610,39 +8830,35 @@ def prenota(material_id: int):
                 f"INSERT INTO {PRENOTAZIONI_TABLE} (material_id, due_time, created_at, macchina_id, is_generic) VALUES (?,?,?,?,?)",
                 (material_id, due_dt.isoformat(timespec='seconds'), created_str, macchina_id_val, is_generic_val)
             )
-            # Commit esplicito prima della registrazione nello storico.
+            # Registra l'evento di prenotazione nello storico, nella stessa transazione dell'inserimento
             try:
-                conn.commit()
+                # Convert the sqlite3.Row to a dict so we can use .get safely
+                try:
+                    matd = dict(materiale)
+                except Exception:
+                    matd = {k: materiale[k] for k in materiale.keys()} if materiale else {}
+                log_slab_events([
+                    {
+                        'slab_id': material_id,
+                        'event_type': 'prenotato',
+                        'from_letter': matd.get('ubicazione_lettera'),
+                        'from_number': matd.get('ubicazione_numero'),
+                        'to_letter': matd.get('ubicazione_lettera'),
+                        'to_number': matd.get('ubicazione_numero'),
+                        'dimensione_x': matd.get('dimensione_x'),
+                        'dimensione_y': matd.get('dimensione_y'),
+                        'spessore': matd.get('spessore'),
+                        'materiale': matd.get('materiale'),
+                        'tipo': matd.get('tipo'),
+                        'fornitore': matd.get('fornitore'),
+                        'produttore': matd.get('produttore'),
+                        'note': matd.get('note'),
+                        'nesting_link': None,
+                    }
+                ], conn=conn)
             except Exception:
                 pass
-        # Registra l'evento di prenotazione nello storico per la lastra
-        try:
-            # Convert the sqlite3.Row to a dict so we can use .get safely
-            try:
-                matd = dict(materiale)
-            except Exception:
-                matd = {k: materiale[k] for k in materiale.keys()} if materiale else {}
-            log_slab_events([
-                {
-                    'slab_id': material_id,
-                    'event_type': 'prenotato',
-                    'from_letter': matd.get('ubicazione_lettera'),
-                    'from_number': matd.get('ubicazione_numero'),
-                    'to_letter': matd.get('ubicazione_lettera'),
-                    'to_number': matd.get('ubicazione_numero'),
-                    'dimensione_x': matd.get('dimensione_x'),
-                    'dimensione_y': matd.get('dimensione_y'),
-                    'spessore': matd.get('spessore'),
-                    'materiale': matd.get('materiale'),
-                    'tipo': matd.get('tipo'),
-                    'fornitore': matd.get('fornitore'),
-                    'produttore': matd.get('produttore'),
-                    'note': matd.get('note'),
-                    'nesting_link': None,
-                }
-            ])
-        except Exception:
-            pass
+            conn.commit()
         flash('Prenotazione registrata con successo!', 'success')
         return redirect(url_for('live'))
     # GET
@@ -8674,42 +8890,39 @@ def delete_prenotazione(pren_id: int):
                 f"DELETE FROM {PRENOTAZIONI_TABLE} WHERE id=?",
                 (pren_id,)
             )
-            # Commit immediato così la riga eliminata è visibile alla connessione dello storico.
-            try:
-                conn.commit()
-            except Exception:
-                pass
+            # Registra l'evento di cancellazione della prenotazione se sono disponibili i dati della lastra,
+            # nella stessa transazione della cancellazione
+            if material_to_log and materiale_row:
+                try:
+                    matd = dict(materiale_row)
+                except Exception:
+                    matd = {}
+                try:
+                    log_slab_events([
+                        {
+                            'slab_id': material_to_log,
+                            'event_type': 'prenotazione_cancellata',
+                            'from_letter': matd.get('ubicazione_lettera'),
+                            'from_number': matd.get('ubicazione_numero'),
+                            'to_letter': matd.get('ubicazione_lettera'),
+                            'to_number': matd.get('ubicazione_numero'),
+                            'dimensione_x': matd.get('dimensione_x'),
+                            'dimensione_y': matd.get('dimensione_y'),
+                            'spessore': matd.get('spessore'),
+                            'materiale': matd.get('materiale'),
+                            'tipo': matd.get('tipo'),
+                            'fornitore': matd.get('fornitore'),
+                            'produttore': matd.get('produttore'),
+                            'note': matd.get('note'),
+                            'nesting_link': None,
+                        }
+                    ], conn=conn)
+                except Exception:
+                    pass
+            conn.commit()
     except Exception:
         # ignora eventuali errori di lettura e cancellazione
         pass
-    # Registra l'evento di cancellazione della prenotazione se sono disponibili i dati della lastra
-    if material_to_log and materiale_row:
-        try:
-            matd = dict(materiale_row)
-        except Exception:
-            matd = {}
-        try:
-            log_slab_events([
-                {
-                    'slab_id': material_to_log,
-                    'event_type': 'prenotazione_cancellata',
-                    'from_letter': matd.get('ubicazione_lettera'),
-                    'from_number': matd.get('ubicazione_numero'),
-                    'to_letter': matd.get('ubicazione_lettera'),
-                    'to_number': matd.get('ubicazione_numero'),
-                    'dimensione_x': matd.get('dimensione_x'),
-                    'dimensione_y': matd.get('dimensione_y'),
-                    'spessore': matd.get('spessore'),
-                    'materiale': matd.get('materiale'),
-                    'tipo': matd.get('tipo'),
-                    'fornitore': matd.get('fornitore'),
-                    'produttore': matd.get('produttore'),
-                    'note': matd.get('note'),
-                    'nesting_link': None,
-                }
-            ])
-        except Exception:
-            pass
     flash('Prenotazione rimossa.', 'success')
     return redirect(url_for('live'))
 
@@ -8789,6 +9002,9 @@ def upload_docs(material_id: int):
     # i documenti vanno replicati su tutte le lastre figlie con doc_type='pallet',
     # altrimenti vengono salvati come documenti specifici della singola lastra.
     doc_type = 'pallet' if is_pallet_flag == 1 else 'materiale'
+    # Le righe di ``documenti`` (file x ID di destinazione) vengono raccolte
+    # durante il salvataggio su disco e inserite con un unico executemany.
+    doc_rows: list[tuple[int, str, str]] = []
     with get_db_connection() as conn:
         for f in files:
             if not f or f.filename == '':
@@ -8807,21 +9023,29 @@ def upload_docs(material_id: int):
             # Estrai l'estensione originale e normalizza in minuscolo
             _, ext = os.path.splitext(orig_name)
             ext = ext.lower()
-            # Salva su ogni ID nella lista (padre + eventuali figli)
+            # Salva su ogni ID nella lista (padre + eventuali figli): il contenuto
+            # viene scritto una sola volta, le altre copie sono hard link al
+            # primo file salvato (vedi ``link_file_to_id``).
+            saved_path = None
             for target_id in id_list:
                 try:
-                    rel_dest = save_file_to_id(content_bytes, ext, target_id, doc_type=doc_type)
-                    conn.execute(
-                        "INSERT INTO documenti (material_id, filename, original_name) VALUES (?, ?, ?)",
-                        (target_id, rel_dest, orig_name)
-                    )
-                    saved_any = True
+                    if saved_path is None:
+                        rel_dest = save_file_to_id(content_bytes, ext, target_id, doc_type=doc_type)
+                        saved_path = os.path.join(UPLOAD_FOLDER, rel_dest)
+                    else:
+                        rel_dest = link_file_to_id(saved_path, ext, target_id, doc_type=doc_type)
+                    doc_rows.append((target_id, rel_dest, orig_name))
                 except Exception:
-                    # Ignora errori di salvataggio/inserimento e continua
+                    # Ignora errori di salvataggio e continua
                     continue
-        if saved_any:
+        if doc_rows:
             try:
+                conn.executemany(
+                    "INSERT INTO documenti (material_id, filename, original_name) VALUES (?, ?, ?)",
+                    doc_rows
+                )
                 conn.commit()
+                saved_any = True
             except Exception:
                 pass
     if saved_any:
@@ -8878,8 +9102,9 @@ def delete_doc(doc_id: int):
     # un parametro ``next`` nel corpo della richiesta o nella query string.
     next_page = request.form.get('next') or request.args.get('next')
     with get_db_connection() as conn:
+        # Rimuovi la riga dal database; RETURNING fornisce il file da eliminare
         row = conn.execute(
-            "SELECT filename FROM documenti WHERE id=?",
+            "DELETE FROM documenti WHERE id=? RETURNING filename",
             (doc_id,)
         ).fetchone()
         if not row:
@@ -8888,17 +9113,13 @@ def delete_doc(doc_id: int):
             if next_page:
                 return redirect(next_page)
             return redirect(request.referrer or url_for('dashboard'))
-        file_path = os.path.join(UPLOAD_FOLDER, row['filename'])
-        try:
-            # Se il file esiste rimuovilo dal filesystem
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception:
-            # Ignora eventuali errori nella cancellazione del file per non interrompere la logica
-            pass
-        # Rimuovi la riga dal database
-        conn.execute("DELETE FROM documenti WHERE id=?", (doc_id,))
         conn.commit()
+    try:
+        # Rimuovi il file dal filesystem solo dopo il commit
+        os.unlink(os.path.join(UPLOAD_FOLDER, row['filename']))
+    except OSError:
+        # Ignora eventuali errori nella cancellazione del file per non interrompere la logica
+        pass
     flash('Documento eliminato.', 'success')
     # Dopo la cancellazione, torna alla pagina specificata nel parametro 'next' se presente,
     # oppure al referer. Come ultima risorsa, torna alla dashboard.
@@ -9231,11 +9452,13 @@ def bulk_move_location():
 
         # Aggiorna la lettera e il numero di ubicazione per tutti gli ID
         placeholders2 = ','.join(['?'] * len(all_ids))
-        conn.execute(
+        cur_upd = conn.execute(
             f"UPDATE materiali SET ubicazione_lettera=?, ubicazione_numero=? WHERE id IN ({placeholders2})",
             (lettera, numero, *list(all_ids))
         )
-        updated = conn.total_changes
+        # ``rowcount`` e non ``conn.total_changes``: le connessioni del pool sono
+        # riutilizzate e il contatore totale include le modifiche delle richieste precedenti.
+        updated = cur_upd.rowcount
         # Per ogni bancale selezionato, verifica se esiste già un bancale equivalente nella destinazione
         for src in pallet_rows:
             eq = conn.execute(
@@ -9314,15 +9537,12 @@ def bulk_move_location():
             # Ignora errori di preparazione
             pass
         if events_move:
-            # Commit prima di registrare gli eventi di spostamento. Le modifiche
-            # effettuate (update dell'ubicazione e merge) devono essere persistite
-            # affinché la connessione di ``log_slab_events`` possa vedere lo
-            # stato aggiornato.
-            try:
-                conn.commit()
-            except Exception:
-                pass
-            log_slab_events(events_move)
+            # Gli eventi vengono scritti nella stessa transazione dello spostamento;
+            # il commit avviene all'uscita dal blocco ``with``.
+            log_slab_events(events_move, conn=conn)
+    if merged:
+        # I documenti dei bancali uniti sono stati ricollegati al bancale di destinazione
+        invalidate_attachments_cache()
     return jsonify({'ok': True, 'updated': updated, 'merged': merged, 'target': f"{lettera}-{numero}"})
 
 # ---------------------------------------------------------------------------